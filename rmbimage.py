@@ -5,25 +5,60 @@ rmbimage.py - My image library
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+import collections
+import contextlib
+import fnmatch
+import functools
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
 import subprocess as sp
+import tempfile
+import threading
+import time
 import rmblogging
-from rmblogging import debug, error
-from PIL import Image
-from PIL import ImageFont
-from PIL import ImageDraw
-from moviepy.editor import ImageSequenceClip
+from rmblogging import Rmblogging, LogLevels, logmsg, debug, warning, error, timed
+from rmbimports import lazy_import
+
+# PIL, moviepy and the like are imported when first used, so that e.g. run_gegl() doesn't pay for them
+asyncio = lazy_import('asyncio')
+concurrent_futures = lazy_import('concurrent.futures')
+Image = lazy_import('PIL.Image')
+ImageFont = lazy_import('PIL.ImageFont')
+ImageDraw = lazy_import('PIL.ImageDraw')
+ImageColor = lazy_import('PIL.ImageColor')
+np = lazy_import('numpy')
+ImageSequenceClip = lazy_import('moviepy.editor', 'ImageSequenceClip')
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+@timed
 def run_gegl(gegl_params):
     """
     Invoke the external gegl CLI process using the command line passed in from caller
+    (or take the output from the result cache, if one is started - see start_result_cache())
     """
 
+    if _result_cache is not None:
+        files = _gegl_files(gegl_params)
+        if files is not None:
+            input_filenames, output_filename, other_params = files
+            _result_cache.run('gegl', other_params, input_filenames, output_filename,
+                              lambda: _run_gegl_cli(gegl_params))
+            return
+    _run_gegl_cli(gegl_params)
+
+
+def _run_gegl_cli(gegl_params):
+
     gegl_full_command = ['gegl'] + gegl_params
 
     debug('')
     debug(f'Running gegl cli..')
-    debug(f'{gegl_full_command = }')
+    debug('gegl_full_command = %r', gegl_full_command)
 
     # Run the gegl command..
 
@@ -39,13 +74,729 @@ def run_gegl(gegl_params):
     except sp.TimeoutExpired as e:
         error(f"Process timed out.\n{e}")
 
-    debug(f"{completed_process = }")
+    debug("completed_process = %r", completed_process)
+
+    if Rmblogging.is_enabled(LogLevels.DEBUG):
+        for line in completed_process.stdout.splitlines():
+            debug("line[:188] = %r", line[:188])
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class GeglJobResult:
+    """
+    The outcome of one job of run_gegl_batch()
+    """
+
+    def __init__(self, index, gegl_params):
+        self.index = index                # (int) Position of the job in the batch
+        self.gegl_params = gegl_params    # (list) The job's gegl parameters
+        self.returncode = None            # (int) gegl's exit status (None if it never ran to completion)
+        self.seconds = None               # (float) Wall clock time of the job
+        self.stdout = []                  # (list) Output lines (without line ends), if keep_output
+        self.stderr = []
+        self.failure = None               # (str) Why the job failed, or None
+
+    @property
+    def ok(self):
+        return self.failure is None
+
+    def __repr__(self):
+        status = 'ok' if self.ok else f'FAILED ({self.failure})'
+        seconds = '?' if self.seconds is None else f"{self.seconds:.3f}"
+        return f"<GeglJobResult #{self.index} {status} in {seconds}s: {self.gegl_params}>"
+
+
+async def _stream_lines(stream, index, name, lines, keep_output):
+    """
+    Log (at DEBUG) each line of a gegl job's stdout or stderr as it arrives.
+    """
+    # (Read in chunks rather than with readline(), which fails on lines longer than the stream's buffer limit)
+    pending = b''
+    while True:
+        chunk = await stream.read(65536)
+        if chunk:
+            *complete, pending = (pending + chunk).split(b'\n')
+        else:
+            complete, pending = ([pending] if pending else []), b''
+        for line in complete:
+            line = line.decode('utf-8', 'replace').rstrip('\r')
+            debug("[gegl #%d %s] %s", index, name, line[:188])
+            if keep_output:
+                lines.append(line)
+        if not chunk:
+            return
+
+
+async def _run_gegl_job(semaphore, result, timeout, keep_output):
+    async with semaphore:
+        start = time.perf_counter()
+        debug("[gegl #%d] starting: %r", result.index, result.gegl_params)
+        try:
+            process = await asyncio.create_subprocess_exec('gegl', *result.gegl_params, stdin=sp.DEVNULL,
+                                                           stdout=sp.PIPE, stderr=sp.PIPE,
+                                                           start_new_session=(os.name == 'posix'))
+        except Exception as e:
+            result.failure = f"could not start gegl: {e}"
+        else:
+            try:
+                await asyncio.wait_for(asyncio.gather(
+                    _stream_lines(process.stdout, result.index, 'stdout', result.stdout, keep_output),
+                    _stream_lines(process.stderr, result.index, 'stderr', result.stderr, keep_output),
+                    process.wait()), timeout)
+            except asyncio.TimeoutError:
+                result.failure = f"timed out after {timeout}s"
+            except Exception as e:
+                result.failure = f"{type(e).__name__}: {e}"
+            if process.returncode is None:
+                with contextlib.suppress(ProcessLookupError):  # (it may have exited just now)
+                    if os.name == 'posix':
+                        os.killpg(process.pid, signal.SIGKILL)  # (gegl and anything it started)
+                    else:
+                        process.kill()
+                await process.wait()
+            result.returncode = process.returncode
+            if result.failure is None and process.returncode != 0:
+                result.failure = f"returned {process.returncode}"
+        result.seconds = time.perf_counter() - start
+
+    if result.ok:
+        debug("[gegl #%d] ok in %.3fs", result.index, result.seconds)
+    else:
+        warning("[gegl #%d] failed in %.3fs, %s: %r", result.index, result.seconds, result.failure, result.gegl_params)
+    return result
+
+
+async def run_gegl_batch_async(gegl_params_list, max_workers=None, timeout=300, keep_output=False, on_result=None):
+    """
+    Coroutine version of run_gegl_batch() (for callers that already run an event loop). Parameters and return value
+    are as for run_gegl_batch().
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    semaphore = asyncio.Semaphore(max_workers)
+    start = time.perf_counter()
+    results = [GeglJobResult(index, list(gegl_params)) for index, gegl_params in enumerate(gegl_params_list)]
+    tasks = [asyncio.ensure_future(_run_gegl_job(semaphore, result, timeout, keep_output)) for result in results]
+    for task in asyncio.as_completed(tasks):
+        result = await task
+        if on_result is not None:
+            on_result(result)
+
+    failed = sum(1 for result in results if not result.ok)
+    logmsg(LogLevels.WARNING if failed else LogLevels.INFO, "gegl batch: %d jobs, %d failed, %.3fs (%d workers)",
+           len(results), failed, time.perf_counter() - start, max_workers)
+    return results
+
+
+@timed
+def run_gegl_batch(gegl_params_list, max_workers=None, timeout=300, keep_output=False, on_result=None):
+    """
+    Run many gegl CLI processes, at most max_workers at a time. Each job's stdout/stderr is logged (at DEBUG) line
+    by line as it is produced, rather than buffered until the process ends. A failing job doesn't stop the batch: each
+    job's status and time is logged, and returned.
+
+    Example..
 
-    for line in completed_process.stdout:
-        debug(f"{line[:188] = }")
+        results = run_gegl_batch([[src, '-o', dst, '--', 'gaussian-blur', 'std-dev-x=2'] for src, dst in pairs], 8)
+        failed = [result for result in results if not result.ok]
+
+    :param gegl_params_list: (iterable) One list of gegl parameters (as for run_gegl()) per job
+    :param max_workers: (int) Maximum number of gegl processes at a time (default: number of CPUs)
+    :param timeout: (float) Seconds after which a job is killed (and counts as failed)
+    :param keep_output: (bool) Also keep each job's output lines, in GeglJobResult.stdout/stderr
+    :param on_result: (callable) If set, called with each GeglJobResult as soon as its job is done
+    :return: (list) A GeglJobResult per job, in the order of gegl_params_list
+    """
+    return asyncio.run(run_gegl_batch_async(gegl_params_list, max_workers, timeout, keep_output, on_result))
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# In-process versions of the gegl operations I use most, on a decoded image held as a float32 NumPy array
+# (height x width x RGBA, linear light, straight alpha - like gegl's "RGBA float"). A chain of operations works on
+# the one array, and the result is encoded once, at the end.
+
+class UnsupportedGeglParams(Exception):
+    """
+    The gegl parameters use something (an option, operation or property) that the in-process engine doesn't have
+    """
+
+
+def _srgb_to_linear(values):
+    values = np.asarray(values, dtype=np.float32)
+    return np.where(values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+
+_srgb_table = []
+
+
+def _srgb_to_linear_table():
+    """
+    :return: (ndarray) 8-bit sRGB value -> linear float32 value
+    """
+    if not _srgb_table:
+        _srgb_table.append(_srgb_to_linear(np.arange(256) / 255))
+    return _srgb_table[0]
+
+
+def _linear_to_srgb(values):
+    values = np.clip(values, 0.0, 1.0)
+    return np.where(values <= 0.0031308, values * 12.92, 1.055 * values ** (1 / 2.4) - 0.055)
+
+
+def _parse_number(name, value):
+    try:
+        return float(value)
+    except ValueError:
+        raise UnsupportedGeglParams(f"{name}={value}") from None
+
+
+def _parse_color(value):
+    """
+    :param value: (str) A gegl color: rgb(r, g, b) or rgba(r, g, b, a) with linear 0..1 components, or (like
+                  #rrggbb, or a name) anything PIL.ImageColor understands, taken as sRGB
+    :return: (ndarray) Linear RGBA, float32
+    """
+    text = value.strip().lower()
+    if text.startswith(('rgb(', 'rgba(')) and text.endswith(')'):
+        try:
+            components = [float(component) for component in text[text.index('(') + 1:-1].split(',')]
+        except ValueError:
+            raise UnsupportedGeglParams(f"value={value}") from None
+        if len(components) == 3:
+            components.append(1.0)
+        if len(components) != 4:
+            raise UnsupportedGeglParams(f"value={value}")
+        return np.array(components, dtype=np.float32)
+    try:
+        rgba = ImageColor.getcolor(value, 'RGBA')
+    except ValueError:
+        raise UnsupportedGeglParams(f"value={value}") from None
+    return np.append(_srgb_to_linear(np.array(rgba[:3]) / 255), rgba[3] / 255).astype(np.float32)
+
+
+def _gegl_brightness_contrast(pixels, contrast='1.0', brightness='0.0'):
+    contrast = _parse_number('contrast', contrast)
+    brightness = _parse_number('brightness', brightness)
+    pixels[..., :3] -= 0.5
+    pixels[..., :3] *= contrast
+    pixels[..., :3] += 0.5 + brightness
+    return pixels
+
+
+def _gaussian_kernel(std_dev):
+    radius = max(1, int(np.ceil(3 * std_dev)))
+    x = np.arange(-radius, radius + 1, dtype=np.float32)
+    kernel = np.exp(-0.5 * (x / std_dev) ** 2)
+    return kernel / kernel.sum()
+
+
+def _blur_axis(pixels, std_dev, axis):
+    """
+    Separable gaussian blur along one axis, with the edge pixels repeated beyond the edges (gegl's default 'clamp'
+    abyss policy). One vectorized multiply-add per kernel tap.
+    """
+    if std_dev <= 0:
+        return pixels
+    kernel = _gaussian_kernel(std_dev)
+    radius = len(kernel) // 2
+    pad = [(0, 0)] * pixels.ndim
+    pad[axis] = (radius, radius)
+    padded = np.pad(pixels, pad, mode='edge')
+    size = pixels.shape[axis]
+    out = np.zeros_like(pixels)
+    window = [slice(None)] * pixels.ndim
+    for tap, weight in enumerate(kernel):
+        window[axis] = slice(tap, tap + size)
+        out += weight * padded[tuple(window)]
+    return out
+
+
+def _premultiplied(pixels):
+    out = pixels.copy()
+    out[..., :3] *= out[..., 3:4]
+    return out
+
+
+def _unpremultiplied(pixels):
+    alpha = pixels[..., 3:4]
+    pixels[..., :3] = np.divide(pixels[..., :3], alpha, out=np.zeros_like(pixels[..., :3]), where=alpha > 0)
+    return pixels
+
+
+def _gegl_gaussian_blur(pixels, std_dev_x='1.5', std_dev_y='1.5', abyss_policy='clamp', clip_extent='true'):
+    std_dev_x = _parse_number('std-dev-x', std_dev_x)
+    std_dev_y = _parse_number('std-dev-y', std_dev_y)
+    if abyss_policy != 'clamp' or clip_extent != 'true':
+        raise UnsupportedGeglParams(f"abyss-policy={abyss_policy} clip-extent={clip_extent}")
+    blurred = _blur_axis(_blur_axis(_premultiplied(pixels), std_dev_x, 1), std_dev_y, 0)
+    return _unpremultiplied(blurred)
+
+
+def _gegl_crop(pixels, x='0', y='0', width='0', height='0'):
+    x, y = int(_parse_number('x', x)), int(_parse_number('y', y))
+    width, height = int(_parse_number('width', width)), int(_parse_number('height', height))
+    if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > pixels.shape[1] or y + height > pixels.shape[0]:
+        # (gegl pads whatever is outside of the image with transparent pixels)
+        raise UnsupportedGeglParams(f"crop x={x} y={y} width={width} height={height} of a "
+                                    f"{pixels.shape[1]}x{pixels.shape[0]} image")
+    return pixels[y:y + height, x:x + width]
+
+
+_RESAMPLING = {'nearest': 'NEAREST', 'linear': 'BILINEAR', 'cubic': 'BICUBIC', 'nohalo': 'LANCZOS',
+               'lohalo': 'LANCZOS'}
+
+
+def _resize(pixels, width, height, sampler):
+    if sampler not in _RESAMPLING:
+        raise UnsupportedGeglParams(f"sampler={sampler}")
+    width, height = max(1, int(round(width))), max(1, int(round(height)))
+    resample = getattr(Image.Resampling, _RESAMPLING[sampler])
+    premultiplied = _premultiplied(pixels)
+    channels = [np.asarray(Image.fromarray(np.ascontiguousarray(premultiplied[..., channel]), 'F')
+                           .resize((width, height), resample)) for channel in range(4)]
+    return _unpremultiplied(np.stack(channels, axis=-1))
+
+
+def _gegl_scale_ratio(pixels, x='1.0', y='1.0', sampler='cubic', abyss_policy='none'):
+    if abyss_policy != 'none':
+        raise UnsupportedGeglParams(f"abyss-policy={abyss_policy}")
+    x, y = _parse_number('x', x), _parse_number('y', y)
+    return _resize(pixels, pixels.shape[1] * x, pixels.shape[0] * y, sampler)
+
+
+def _gegl_scale_size(pixels, x='100.0', y='100.0', sampler='cubic', abyss_policy='none'):
+    if abyss_policy != 'none':
+        raise UnsupportedGeglParams(f"abyss-policy={abyss_policy}")
+    return _resize(pixels, _parse_number('x', x), _parse_number('y', y), sampler)
+
+
+def _gegl_color_overlay(pixels, value='transparent', srgb='false'):
+    if srgb != 'false':
+        raise UnsupportedGeglParams(f"srgb={srgb}")
+    color = _parse_color(value)
+    pixels[..., :3] *= 1 - color[3]
+    pixels[..., :3] += color[:3] * color[3]
+    return pixels
+
+
+# gegl operation name -> function(pixels, **properties) returning the new pixels (possibly the same array, modified).
+# Property names have '-' replaced by '_', and values are passed as the strings from the command line.
+GEGL_OPERATIONS = {
+    'brightness-contrast': _gegl_brightness_contrast,
+    'gaussian-blur': _gegl_gaussian_blur,
+    'crop': _gegl_crop,
+    'scale-ratio': _gegl_scale_ratio,
+    'scale-size': _gegl_scale_size,
+    'color-overlay': _gegl_color_overlay,
+}
+
+
+def parse_gegl_params(gegl_params):
+    """
+    Splits gegl CLI parameters of the form..
+
+        input.png -o output.png -- brightness-contrast contrast=1.2 gaussian-blur std-dev-x=3 std-dev-y=3 ...
+
+    :param gegl_params: (list) Parameters for the gegl CLI (as for run_gegl())
+    :return: (tuple) (input filename, output filename, list of (operation name, dict of property -> str value))
+    :raise UnsupportedGeglParams: For any other gegl option, or an operation not in GEGL_OPERATIONS
+    """
+    input_filename = output_filename = None
+    params = iter(gegl_params)
+    for param in params:
+        if param == '--':
+            break
+        if param in ('-o', '--output'):
+            output_filename = next(params, None)
+        elif param.startswith('-') or input_filename is not None:
+            raise UnsupportedGeglParams(param)
+        else:
+            input_filename = param
+    if input_filename is None or output_filename is None:
+        raise UnsupportedGeglParams("need an input and an output file")
+
+    operations = []
+    for param in params:
+        name, equals, value = param.partition('=')
+        if equals:
+            if not operations:
+                raise UnsupportedGeglParams(param)
+            operations[-1][1][name] = value
+        else:
+            name = name[len('gegl:'):] if name.startswith('gegl:') else name
+            if name not in GEGL_OPERATIONS:
+                raise UnsupportedGeglParams(f"operation {param}")
+            operations.append((name, {}))
+    return input_filename, output_filename, operations
+
+
+def apply_gegl_operations(pixels, operations):
+    """
+    :param pixels: (ndarray) Linear RGBA float32 image (height x width x 4). May be modified.
+    :param operations: (list) (operation name, dict of property -> str value), as from parse_gegl_params()
+    :return: (ndarray) The result
+    :raise UnsupportedGeglParams: For a property (or property value) an operation doesn't have
+    """
+    for name, properties in operations:
+        func = GEGL_OPERATIONS[name]
+        kwargs = {prop.replace('-', '_'): value for prop, value in properties.items()}
+        unknown = set(kwargs) - set(func.__code__.co_varnames[1:func.__code__.co_argcount])
+        if unknown:
+            raise UnsupportedGeglParams(f"{name} {' '.join(sorted(unknown))}")
+        pixels = func(pixels, **kwargs)
+    return pixels
+
+
+_EIGHT_BIT_MODES = ('1', 'L', 'LA', 'P', 'PA', 'RGB', 'RGBA')
+
+
+def load_linear_rgba(filename):
+    """
+    :param filename: (str) An image file
+    :return: (tuple) (linear RGBA float32 array, whether the image has an alpha channel, the PIL image info dict)
+    :raise UnsupportedGeglParams: If PIL can't decode the image (e.g., EXR or camera RAW, which gegl reads), or it
+                                  isn't 8 bits per channel (which gegl keeps, and converting here would lose)
+    """
+    try:
+        with Image.open(filename) as img:
+            if img.mode not in _EIGHT_BIT_MODES:
+                raise UnsupportedGeglParams(f"{filename}: image mode {img.mode}")
+            has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+            info = dict(img.info)
+            rgba = np.asarray(img.convert('RGBA'))
+    except FileNotFoundError:
+        raise
+    except Image.UnidentifiedImageError as e:
+        raise UnsupportedGeglParams(str(e)) from None
+    except (ValueError, OSError) as e:
+        raise UnsupportedGeglParams(f"{filename}: {e}") from None
+    pixels = np.empty(rgba.shape, dtype=np.float32)
+    pixels[..., :3] = _srgb_to_linear_table()[rgba[..., :3]]
+    pixels[..., 3] = rgba[..., 3] / np.float32(255)
+    return pixels, has_alpha, info
+
+
+def save_linear_rgba(pixels, filename, has_alpha=True, **save_kwargs):
+    """
+    :param pixels: (ndarray) Linear RGBA float32 image
+    :param filename: (str) Output file. The format follows from the extension.
+    :param has_alpha: (bool) Keep the alpha channel (if the format can hold one)
+    :param save_kwargs: Passed on to PIL's Image.save() (e.g., quality=90)
+    """
+    rgba = np.empty(pixels.shape, dtype=np.uint8)
+    rgba[..., :3] = np.rint(_linear_to_srgb(pixels[..., :3]) * 255)
+    rgba[..., 3] = np.rint(np.clip(pixels[..., 3], 0.0, 1.0) * 255)
+    img = Image.fromarray(rgba, 'RGBA')
+    if not has_alpha or os.path.splitext(filename)[1].lower() in ('.jpg', '.jpeg', '.bmp', '.ppm'):
+        img = img.convert('RGB')
+    img.save(filename, **save_kwargs)
+
+
+@timed
+def run_gegl_inprocess(gegl_params):
+    """
+    Like run_gegl(), but without the gegl process: the image is decoded once, the operations are applied in this
+    process (see GEGL_OPERATIONS), and the result is encoded once. Falls back to run_gegl() for gegl parameters the
+    in-process engine doesn't support.
+
+    Example..
+
+        run_gegl_inprocess(['in.png', '-o', 'out.png', '--', 'crop', 'width=640', 'height=480',
+                            'gaussian-blur', 'std-dev-x=2', 'std-dev-y=2', 'brightness-contrast', 'contrast=1.1'])
+
+    :param gegl_params: (list) Parameters for the gegl CLI
+    :return: (bool) True if the operations ran in process, False if they were handed to the gegl CLI
+    """
+    try:
+        input_filename, output_filename, operations = parse_gegl_params(gegl_params)
+        if _result_cache is None:
+            _run_gegl_operations(input_filename, output_filename, operations)
+        else:
+            _result_cache.run('gegl-inprocess', operations, [input_filename], output_filename,
+                              lambda: _run_gegl_operations(input_filename, output_filename, operations))
+    except UnsupportedGeglParams as e:
+        debug("Not supported in process (%s), running the gegl cli", e)
+        run_gegl(gegl_params)
+        return False
+    return True
+
+
+def _run_gegl_operations(input_filename, output_filename, operations):
+    pixels, has_alpha, info = load_linear_rgba(input_filename)
+    pixels = apply_gegl_operations(pixels, operations)
+    debug("gegl operations run in process: %r", operations)
+    save_kwargs = {key: info[key] for key in ('dpi', 'icc_profile') if key in info}
+    save_linear_rgba(pixels, output_filename, has_alpha, **save_kwargs)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class ResultCache:
+    """
+    On-disk cache of the output files of image operations, keyed by a hash of the input file contents, the operation
+    and its parameters. On a hit the cached output is hardlinked (or copied) to the output filename instead of being
+    recomputed.
+
+    Several processes may share one cache directory: entries are written to a temporary file and renamed into place,
+    so a reader never sees a partial entry. Least recently used entries are removed once the cache grows beyond
+    max_bytes (checked on this process' writes, so other processes' writes are counted at the next full scan).
+
+    Use start_result_cache() to have run_gegl(), run_gegl_inprocess() and add_filename_to_image() go through a cache.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024**3, hardlink=True):
+        """
+        :param directory: (str) Where the cache entries go. Created if needed.
+        :param max_bytes: (int) Size limit of the cache
+        :param hardlink: (bool) Hardlink the cached file to the output on a hit (else copy it). run() breaks the link
+                         before recomputing an output, but other code must not modify outputs in place.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hardlink = hardlink
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._size_estimate = None  # Bytes in the cache, as of the last full scan plus this process' writes since
+        self._file_hashes = {}      # (path, size, mtime_ns, inode) -> sha256 hex digest of the file's contents
+
+    def stats(self):
+        """
+        :return: (dict) hits, misses, stores (entries written) and evictions (entries removed) by this process
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores, 'evictions': self.evictions}
+
+    def file_hash(self, filename):
+        """
+        :param filename: (str) A file
+        :return: (str) sha256 hex digest of its contents (remembered until the file changes)
+        """
+        st = os.stat(filename)
+        identity = (os.path.abspath(filename), st.st_size, st.st_mtime_ns, st.st_ino)
+        digest = self._file_hashes.get(identity)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(filename, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(block)
+            digest = self._file_hashes[identity] = sha.hexdigest()
+        return digest
+
+    def key(self, operation, params, input_filenames, output_filename):
+        """
+        :param operation: (str) Name of the operation
+        :param params: (any) The operation's parameters (anything json can encode, or whose repr is stable)
+        :param input_filenames: (list) The files the operation reads
+        :param output_filename: (str) The file the operation writes (only its extension is part of the key)
+        :return: (str) The cache key
+        """
+        description = json.dumps([operation, params, [self.file_hash(filename) for filename in input_filenames],
+                                  os.path.splitext(output_filename)[1].lower()], default=repr)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def _entry_filename(self, key):
+        return os.path.join(self.directory, 'objects', key[:2], key)
+
+    def fetch(self, key, output_filename):
+        """
+        :param key: (str) A cache key
+        :param output_filename: (str) Where to put the cached output
+        :return: (bool) True on a hit (output_filename written), False on a miss
+        """
+        entry = self._entry_filename(key)
+        temp_filename = f"{output_filename}.tmp{os.getpid()}-{threading.get_ident()}"
+        try:
+            try:
+                if not self.hardlink:
+                    raise OSError
+                os.link(entry, temp_filename)
+            except FileNotFoundError:
+                raise
+            except OSError:
+                shutil.copyfile(entry, temp_filename)  # (hardlinking is off, or not possible to this file system)
+            os.replace(temp_filename, output_filename)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_filename)  # (rename() does nothing if output_filename already was this entry)
+            os.utime(entry)  # Last used now (the mtime of an entry is its LRU timestamp)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, filename):
+        """
+        :param key: (str) A cache key
+        :param filename: (str) The output file to keep under the key
+        """
+        entry = self._entry_filename(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        fd, temp_filename = tempfile.mkstemp(dir=os.path.dirname(entry), prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f, open(filename, 'rb') as source:
+                shutil.copyfileobj(source, f)
+            shutil.copymode(filename, temp_filename)
+            size = os.path.getsize(temp_filename)
+            os.replace(temp_filename, entry)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_filename)
+            raise
+        with self._lock:
+            self.stores += 1
+            if self._size_estimate is not None:
+                self._size_estimate += size
+            over = self._size_estimate is None or self._size_estimate > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """
+        Scan the cache, and remove the least recently used entries until it is within max_bytes again (or rather, 90%
+        of it, so that the next few writes don't each trigger a scan).
+        """
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.directory, 'objects')):
+            for name in filenames:
+                if name.startswith('.tmp'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, path))
+        total = sum(size for mtime_ns, size, path in entries)
+        evictions = 0
+        if total > self.max_bytes:
+            entries.sort()
+            for mtime_ns, size, path in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                    evictions += 1
+                total -= size
+        with self._lock:
+            self._size_estimate = total
+            self.evictions += evictions
+        if evictions:
+            debug("Result cache: evicted %d entries, %d bytes left", evictions, total)
+
+    @staticmethod
+    def _unlink_output(output_filename):
+        """
+        If output_filename is hardlinked (e.g. to a cache entry, by an earlier hit), give it an inode of its own: gegl
+        and PIL write their output files in place, which would otherwise overwrite the cache entry too. (The file is
+        copied rather than removed, as it may also be the operation's input.)
+        """
+        try:
+            if os.stat(output_filename).st_nlink <= 1:
+                return
+        except FileNotFoundError:
+            return
+        temp_filename = f"{output_filename}.tmp{os.getpid()}-{threading.get_ident()}"
+        shutil.copy2(output_filename, temp_filename)
+        os.replace(temp_filename, output_filename)
+
+    def run(self, operation, params, input_filenames, output_filename, compute):
+        """
+        Put the result of an operation into output_filename: from the cache if it's there, otherwise by calling
+        compute() (which must write output_filename) and keeping the result in the cache.
+
+        :param operation: (str) Name of the operation
+        :param params: (any) The operation's parameters
+        :param input_filenames: (list) The files the operation reads
+        :param output_filename: (str) The file the operation writes
+        :param compute: (callable) Performs the operation
+        :return: (bool) True on a cache hit
+        """
+        key = self.key(operation, params, input_filenames, output_filename)
+        if self.fetch(key, output_filename):
+            debug("Result cache hit: %s -> %s", operation, output_filename)
+            return True
+        self._unlink_output(output_filename)
+        compute()
+        try:
+            self.store(key, output_filename)
+        except OSError as e:
+            warning(f"Result cache: could not store {output_filename}: {e}")
+        return False
+
+
+_result_cache = None
+
+
+def start_result_cache(directory, max_bytes=2 * 1024**3, hardlink=True):
+    """
+    Have run_gegl(), run_gegl_inprocess() and add_filename_to_image() go through a ResultCache (replacing any previous
+    one). Parameters are as for ResultCache.
+
+    :return: (ResultCache) The new cache
+    """
+    global _result_cache
+    _result_cache = ResultCache(directory, max_bytes=max_bytes, hardlink=hardlink)
+    return _result_cache
+
+
+def stop_result_cache():
+    """
+    Stop using the result cache (the cache directory is left as it is).
+
+    :return: (dict) The final stats() of the cache, or None if there was none
+    """
+    global _result_cache
+    cache, _result_cache = _result_cache, None
+    return None if cache is None else cache.stats()
+
+
+def _gegl_files(gegl_params):
+    """
+    :param gegl_params: (list) Parameters for the gegl CLI
+    :return: (tuple) (list of input filenames, output filename, the other parameters), or None if the inputs can't be
+             told (e.g., XML graphs, or a file property that doesn't name an existing file). The inputs are the input
+             file, and any file that an operation property names (e.g., gegl:layer src=overlay.png), so that those are
+             part of the cache key, too.
+    """
+    input_filename = output_filename = None
+    other_params = []
+    params = iter(gegl_params)
+    for param in params:
+        if param == '--':
+            other_params.append(param)
+            other_params.extend(params)
+            break
+        if param in ('-o', '--output'):
+            output_filename = next(params, None)
+        elif param.startswith('-') or input_filename is not None:
+            return None
+        else:
+            input_filename = param
+    if input_filename is None or output_filename is None:
+        return None
+    input_filenames = [input_filename]
+    for param in other_params:
+        name, equals, value = param.partition('=')
+        if not equals:
+            continue
+        if os.path.isfile(value):
+            input_filenames.append(value)
+        elif name in _GEGL_FILE_PROPERTIES:
+            return None  # (A file gegl finds some other way, e.g. a URI)
+    return input_filenames, output_filename, other_params
+
+
+_GEGL_FILE_PROPERTIES = ('path', 'src', 'uri', 'file', 'filename')
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+@timed
 def add_filename_to_image(input_filename, output_filename):
     """
     Writes the name of an image file in the top left corner of the image, using a small font.
@@ -62,14 +813,157 @@ def add_filename_to_image(input_filename, output_filename):
     debug(f'{font_size = }')
     debug(f'{color = }')
 
+    _add_filename(input_filename, output_filename, x, y, font_name, font_size, color)
+
+
+def _add_filename(input_filename, output_filename, x, y, font_name, font_size, color):
+    if _result_cache is None:
+        _draw_filename(input_filename, output_filename, x, y, font_name, font_size, color)
+    else:
+        _result_cache.run('add_filename_to_image', [output_filename, x, y, font_name, font_size, color],
+                          [input_filename], output_filename,
+                          lambda: _draw_filename(input_filename, output_filename, x, y, font_name, font_size, color))
+
+
+def _draw_filename(input_filename, output_filename, x, y, font_name, font_size, color):
+    mask, (dx, dy) = _label_mask(f"[{output_filename}]", font_name, font_size)
     with Image.open(input_filename) as img:
-        font = ImageFont.truetype(font_name, font_size)
-        draw = ImageDraw.Draw(img)
-        draw.text((x, y), f"[{output_filename}]", color, font=font)
-        img.save(output_filename)
+        ImageDraw.Draw(img).bitmap((x + dx, y + dy), mask, fill=color)
+        img.save(output_filename, **_save_kwargs(img, output_filename))
+
+
+@functools.lru_cache(maxsize=None)
+def _font(font_name, font_size):
+    return ImageFont.truetype(font_name, font_size)
+
+
+@functools.lru_cache(maxsize=1024)
+def _label_mask(text, font_name, font_size):
+    """
+    :return: (tuple) (the text rendered as an 'L' mode alpha mask, (x, y) offset of the mask from the text origin)
+    """
+    font = _font(font_name, font_size)
+    left, top, right, bottom = font.getbbox(text)
+    mask = Image.new('L', (max(1, right - left), max(1, bottom - top)))
+    ImageDraw.Draw(mask).text((-left, -top), text, 255, font=font)
+    return mask, (left, top)
+
+
+def _save_kwargs(img, output_filename):
+    """
+    :return: (dict) Image.save() arguments that keep the source image's encoder settings (JPEG quality and chroma
+             subsampling, ICC profile, EXIF, DPI), as far as the output format allows
+    """
+    info = img.info
+    kwargs = {key: info[key] for key in ('icc_profile', 'exif', 'dpi') if info.get(key)}
+    output_format = Image.registered_extensions().get(os.path.splitext(output_filename)[1].lower())
+    if img.format == 'JPEG' and output_format == 'JPEG':
+        kwargs.update(quality='keep', subsampling='keep')
+    elif img.format == 'PNG' and output_format == 'PNG':
+        kwargs.update({key: info[key] for key in ('transparency', 'gamma') if key in info})
+    return kwargs
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Batch annotation: add_filename_to_image() for many images, across a process pool. Each worker keeps its fonts and
+# rendered labels (see _font() and _label_mask()), and the input list is consumed lazily, with a bounded number of
+# images in flight, so memory use doesn't depend on the length of the list.
+
+def _init_annotation_worker(cache_args, log_initargs):
+    if cache_args is not None:
+        start_result_cache(*cache_args)
+    if log_initargs is not None:
+        rmblogging.init_worker_logging(*log_initargs)
+
+
+def _annotate(input_filename, output_filename, x, y, font_name, font_size, color):
+    """
+    :return: (tuple) (input_filename, output_filename, None, or the error message if it failed)
+    """
+    try:
+        _add_filename(input_filename, output_filename, x, y, font_name, font_size, color)
+    except Exception as e:
+        return input_filename, output_filename, f"{type(e).__name__}: {e}"
+    return input_filename, output_filename, None
+
+
+def iter_add_filename_to_images(pairs, workers=None, xy=(0, 0), font_name='kalimati.ttf', font_size=8,
+                                color=(255, 255, 255)):
+    """
+    :param pairs: (iterable) (input filename, output filename) pairs. Consumed lazily.
+    :param workers: (int) Number of worker processes (default: one per CPU; 1 annotates in this process)
+    :param xy: (tuple) Where the label goes
+    :param font_name: (str) TrueType font file
+    :param font_size: (int) Font size
+    :param color: (tuple) RGB label color
+    :return: (generator) Yields (input filename, output filename, None or an error message), in order of completion
+    """
+    x, y = xy
+    if workers == 1:
+        for input_filename, output_filename in pairs:
+            yield _annotate(input_filename, output_filename, x, y, font_name, font_size, color)
+        return
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    cache = _result_cache
+    cache_args = None if cache is None else (cache.directory, cache.max_bytes, cache.hardlink)
+    collector = Rmblogging._log_collector
+    log_initargs = None if collector is None else collector.initargs
+    max_in_flight = 4 * workers
+    with concurrent_futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_annotation_worker,
+                                                initargs=(cache_args, log_initargs)) as pool:
+        in_flight = set()
+        for input_filename, output_filename in pairs:
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = concurrent_futures.wait(in_flight, return_when=concurrent_futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            in_flight.add(pool.submit(_annotate, input_filename, output_filename, x, y, font_name, font_size, color))
+        for future in concurrent_futures.as_completed(in_flight):
+            yield future.result()
+
+
+@timed
+def add_filename_to_images(pairs, workers=None, **kwargs):
+    """
+    add_filename_to_image() for each (input filename, output filename) pair, across a process pool. A failing image
+    is logged (as a warning) and doesn't stop the others. Other arguments are as for iter_add_filename_to_images().
+
+    Example..
+
+        add_filename_to_images((f, os.path.join('labelled', os.path.basename(f))) for f in glob.iglob('frames/*.png'))
+
+    :return: (tuple) (number of images annotated, list of (input filename, output filename, error message) failures)
+    """
+    done = 0
+    failures = []
+    for input_filename, output_filename, failure in iter_add_filename_to_images(pairs, workers, **kwargs):
+        if failure is None:
+            done += 1
+        else:
+            warning("Could not add the filename to %s: %s", input_filename, failure)
+            failures.append((input_filename, output_filename, failure))
+    logmsg(LogLevels.WARNING if failures else LogLevels.INFO, "Added filenames to %d images, %d failed",
+           done, len(failures))
+    return done, failures
+
+
+def add_filename_to_directory(input_directory, output_directory, pattern='*', workers=None, **kwargs):
+    """
+    add_filename_to_images() for every file in input_directory matching pattern, writing to files of the same name in
+    output_directory (which is created if needed).
+
+    :return: (tuple) As for add_filename_to_images()
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    pairs = ((entry.path, os.path.join(output_directory, entry.name)) for entry in os.scandir(input_directory)
+             if entry.is_file() and fnmatch.fnmatch(entry.name, pattern))
+    return add_filename_to_images(pairs, workers, **kwargs)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+@timed
 def image_sequence_to_mp4(clips_directory, fps, output_filename):
     """
     Uses moviepy.ImageSequenceClip to generate a single mp4 file from a sequence of images.
@@ -80,7 +974,122 @@ def image_sequence_to_mp4(clips_directory, fps, output_filename):
     • There must not be anything other than the image sequence files in the sequence directory.
     • All images must be of the same dimension.
 
+    (See frames_to_mp4() for long sequences: it streams the frames to ffmpeg, without these restrictions.)
     """
     clip = ImageSequenceClip(clips_directory, fps=fps)
     clip.write_videofile(output_filename)
 
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def natural_sort_key(text):
+    """
+    :param text: (str) e.g. a filename
+    :return: (list) Sort key that orders the digit runs in text by value, e.g. frame2.png before frame10.png
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', text)]
+
+
+def _frame_rgb(frame, size):
+    """
+    :param frame: A filename, PIL image or NumPy array (height x width [x channels], uint8)
+    :param size: (tuple) (width, height) of the video, or None for the first frame
+    :return: (PIL.Image) The frame as an RGB image of the video's size
+    """
+    if isinstance(frame, (str, os.PathLike)):
+        with Image.open(frame) as img:
+            img = img.convert('RGB')
+    elif isinstance(frame, Image.Image):
+        img = frame.convert('RGB')
+    else:
+        img = Image.fromarray(np.asarray(frame, dtype=np.uint8)).convert('RGB')
+    if size is not None and img.size != size:
+        img = img.resize(size, Image.Resampling.BICUBIC)
+    return img
+
+
+@timed
+def frames_to_mp4(frames, fps, output_filename, prefetch=8, decode_workers=2, codec='libx264', crf=None,
+                  ffmpeg='ffmpeg', extra_args=()):
+    """
+    Streams a sequence of frames into ffmpeg: frames are decoded lazily (decode_workers at a time, overlapping with
+    the encoding), and at most prefetch decoded frames are held in memory, however long the sequence is. Unlike
+    image_sequence_to_mp4(), frames don't have to be files in a directory of their own, and frames of a different size
+    than the first one are scaled to its size.
+
+    Example..
+
+        frames_to_mp4('clips/frame*.png', 30, 'out.mp4')                          # frame2.png comes before frame10.png
+        frames_to_mp4((render(t) for t in range(10000)), 60, 'out.mp4')           # PIL images or NumPy arrays
+
+    :param frames: (str or iterable) A glob pattern (the matching files are taken in natural sort order), or an
+                   iterable of filenames, PIL images and/or NumPy (height x width [x channels], uint8) arrays
+    :param fps: (float) Frames per second
+    :param output_filename: (str) The video file (overwritten if it exists)
+    :param prefetch: (int) Maximum number of frames decoded ahead of the encoder
+    :param decode_workers: (int) Number of threads decoding frames
+    :param codec: (str) ffmpeg video codec
+    :param crf: (int) If set, the codec's constant rate factor (quality)
+    :param ffmpeg: (str) The ffmpeg executable
+    :param extra_args: (list) More ffmpeg output options
+    :return: (int) The number of frames written
+    """
+    if isinstance(frames, str):
+        frames = sorted(glob.iglob(frames), key=natural_sort_key)
+    frames = iter(frames)
+    first = next(frames, None)
+    if first is None:
+        error(f"No frames for {output_filename}")
+    first = _frame_rgb(first, None)
+    size = first.size
+
+    ffmpeg_command = [ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                      '-s', f'{size[0]}x{size[1]}', '-r', str(fps), '-i', '-',
+                      '-c:v', codec, '-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+    if crf is not None:
+        ffmpeg_command += ['-crf', str(crf)]
+    ffmpeg_command += list(extra_args) + [output_filename]
+    debug('ffmpeg_command = %r', ffmpeg_command)
+
+    try:
+        process = sp.Popen(ffmpeg_command, stdin=sp.PIPE, stdout=sp.DEVNULL, stderr=sp.PIPE)
+    except FileNotFoundError as e:
+        error(f"Could not start ffmpeg.\n{e}")
+    stderr_lines = collections.deque(maxlen=20)
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+
+    count = 0
+    try:
+        with concurrent_futures.ThreadPoolExecutor(max_workers=decode_workers) as pool:
+            pending = collections.deque()
+            next_frame = first
+            while next_frame is not None or pending:
+                # Keep up to prefetch frames decoding (in order) ahead of the one being written
+                while next_frame is not None and len(pending) < prefetch:
+                    if isinstance(next_frame, Image.Image) and next_frame.size == size and next_frame.mode == 'RGB':
+                        pending.append(next_frame)
+                    else:
+                        pending.append(pool.submit(_frame_rgb, next_frame, size))
+                    next_frame = next(frames, None)
+                frame = pending.popleft()
+                if not isinstance(frame, Image.Image):
+                    frame = frame.result()
+                process.stdin.write(frame.tobytes())
+                count += 1
+    except BrokenPipeError:
+        pass  # ffmpeg exited early, its return code and stderr tell why
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        with contextlib.suppress(OSError):
+            process.stdin.close()
+        returncode = process.wait()
+        stderr_thread.join()
+
+    if returncode != 0:
+        error(f"ffmpeg failed, returned {returncode} after {count} frames.\n"
+              + b''.join(stderr_lines).decode('utf-8', 'replace'))
+    debug("%d frames written to %s", count, output_filename)
+    return count
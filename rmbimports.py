@@ -0,0 +1,162 @@
+#!/bin/env python3
+"""
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+rmbimports.py - Lazy imports, and a report of what importing each of my modules costs
+
+Lazy imports. Heavy third-party modules (moviepy, PIL, selenium, ...) are only imported when first used, so scripts
+that import one of my modules for some small part of it don't pay for the rest..
+
+    from rmbimports import lazy_import
+
+    Image = lazy_import('PIL.Image')                                       # a module
+    ImageSequenceClip = lazy_import('moviepy.editor', 'ImageSequenceClip')  # an attribute of a module
+
+    img = Image.open(filename)        # <- PIL.Image is imported here
+
+A lazy module also imports its submodules on first access (e.g., selenium.webdriver.remote.webelement).
+
+Import cost report. Each module is imported in a fresh interpreter (python -X importtime), so the times are cold-start
+times, and the heaviest imports under each module are listed..
+
+    python rmbimports.py                  # All of my rmb*.py modules
+    python rmbimports.py rmbimage         # Just these
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import argparse
+import glob
+import importlib
+import os
+import subprocess as sp
+import sys
+import threading
+
+
+class _LazyObject:
+    """
+    Stands in for a module (or an attribute of a module) that is imported on first use. Attribute access and calls
+    are passed on to the real thing.
+    """
+
+    def __init__(self, module_name, attribute=None):
+        object.__setattr__(self, '_module_name', module_name)
+        object.__setattr__(self, '_attribute', attribute)
+        object.__setattr__(self, '_target', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _resolve(self):
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    target = importlib.import_module(self._module_name)
+                    if self._attribute is not None:
+                        target = getattr(target, self._attribute)
+                    object.__setattr__(self, '_target', target)
+                target = self._target
+        return target
+
+    def __getattr__(self, name):
+        target = self._resolve()
+        try:
+            return getattr(target, name)
+        except AttributeError:
+            if self._attribute is not None or name.startswith('__'):
+                raise
+        # Not (yet) an attribute of the module: maybe a submodule that hasn't been imported
+        try:
+            return importlib.import_module(f"{self._module_name}.{name}")
+        except ModuleNotFoundError:
+            raise AttributeError(f"module '{self._module_name}' has no attribute '{name}'") from None
+
+    def __setattr__(self, name, value):
+        setattr(self._resolve(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        what = self._module_name if self._attribute is None else f"{self._module_name}.{self._attribute}"
+        state = 'imported' if self._target is not None else 'not imported yet'
+        return f"<lazy {what} ({state})>"
+
+
+def lazy_import(module_name, attribute=None):
+    """
+    :param module_name: (str) Full name of the module, e.g. 'PIL.Image'
+    :param attribute: (str) If set, stand in for this attribute of the module rather than the module itself
+    :return: An object that imports the module on first use, and then behaves like the module (or attribute)
+    """
+    return _LazyObject(module_name, attribute)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def my_modules():
+    """
+    :return: (list) The names of my modules (the rmb*.py files next to this one)
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return sorted(os.path.splitext(os.path.basename(filename))[0] for filename in glob.glob(os.path.join(directory, 'rmb*.py')))
+
+
+def import_cost(module_name, python=None):
+    """
+    Imports a module in a fresh interpreter, with -X importtime.
+
+    :param module_name: (str) The module to import
+    :param python: (str) The interpreter to use (default: this one)
+    :return: (tuple) (cumulative import time of the module in microseconds, or None if the import failed,
+                      dict of every module imported along the way -> its cumulative import time in microseconds,
+                      the import error message, or None)
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [directory, os.environ.get('PYTHONPATH')])))
+    completed_process = sp.run([python or sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+                               capture_output=True, encoding='utf-8', env=env)
+    times = {}
+    for line in completed_process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1])
+        except ValueError:
+            continue  # The header line
+        times[fields[2].strip()] = cumulative
+    if completed_process.returncode != 0:
+        lines = completed_process.stderr.strip().splitlines()
+        return None, times, lines[-1] if lines else f"exit code {completed_process.returncode}"
+    return times.get(module_name), times, None
+
+
+def import_cost_report(module_names=None, top_n=5, print_func=print):
+    """
+    Reports the cold-start import time of each module, and the top_n heaviest imports under it.
+
+    :param module_names: (list) The modules (default: my_modules())
+    :param top_n: (int) How many of the heaviest imports to list per module
+    :param print_func: (callable) Where the report lines go (e.g., rmblogging.info)
+    """
+    if module_names is None:
+        module_names = my_modules()
+    print_func("import cost (cold start, cumulative)...")
+    for module_name in module_names:
+        cumulative, times, failure = import_cost(module_name)
+        if failure is not None:
+            print_func(f"    {'--':>10s}    {module_name}: import failed: {failure}")
+            continue
+        print_func(f"    {cumulative / 1000:10.1f} ms {module_name}")
+        heaviest = sorted(((us, name) for name, us in times.items()
+                           if name != module_name and '.' not in name), reverse=True)[:top_n]
+        for us, name in heaviest:
+            print_func(f"        {us / 1000:10.1f} ms {name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report the cold-start import cost of my modules')
+    parser.add_argument("modules", nargs='*', default=None)
+    parser.add_argument("--top", default=5, type=int)
+    cmdline_args = parser.parse_args()
+
+    import_cost_report(cmdline_args.modules or None, top_n=cmdline_args.top)
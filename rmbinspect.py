@@ -12,34 +12,235 @@ Example..
 
     callables = insp.callables(int)
     noncallables = insp.noncallables(int)
+    callables, noncallables = insp.partition(int)   # Both at once, in a single pass
+
+Results for classes and modules are cached (until the class's or module's __dict__ changes).
+
+Static mode, for objects whose attributes are expensive (or unsafe) to evaluate, such as Selenium WebElements. Nothing
+is invoked, and each attribute's kind is reported ('method', 'property', 'classmethod', 'data', ...)..
+
+    insp.show_kinds(web_element)
+    kinds = insp.kinds(web_element)
+    callables, noncallables = insp.partition(web_element, static=True)
+
+Memory footprint: what an object really costs, everything it references included, by type and by attribute path..
+
+    insp.show_footprint(obj)
+    fp = insp.footprint(obj, max_depth=10)
 
 ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 """
 
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import gc
+import heapq
+import importlib
+import inspect
+import json
+import os
+import pkgutil
+import sys
+import types
+import weakref
+
+
+# Classification results for type and module objects (which are typically inspected over and over), keyed weakly so
+# they don't keep anything alive. Each entry also holds a fingerprint of the object's __dict__ (and those of its
+# bases), and is only used while that still matches.
+_cache = weakref.WeakKeyDictionary()
+_static_cache = weakref.WeakKeyDictionary()
+
+
+def _fingerprint(obj):
+    """
+    :return: (tuple) The names and value ids of everything in the __dict__ of obj (and of its bases, for a class)
+    """
+    dicts = [vars(cls) for cls in obj.__mro__] if isinstance(obj, type) else [vars(obj)]
+    return tuple((tuple(d), tuple(map(id, d.values()))) for d in dicts)
+
+
+def _cached(cache, obj, compute):
+    """
+    :param cache: (WeakKeyDictionary) The cache to use
+    :param obj: The object being inspected (results are only cached for type and module objects)
+    :param compute: (callable) Computes the result for obj
+    :return: The (possibly cached) result of compute(obj)
+    """
+    if not issubclass(type(obj), (type, types.ModuleType)):  # (Not isinstance(), which may look up obj.__class__)
+        return compute(obj)
+    fingerprint = _fingerprint(obj)
+    try:
+        cached_fingerprint, result = cache[obj]
+        if cached_fingerprint == fingerprint:
+            return result
+    except (KeyError, TypeError):
+        pass
+    result = compute(obj)
+    try:
+        cache[obj] = (fingerprint, result)
+    except TypeError:
+        pass  # Not weak-referenceable
+    return result
+
+
+def _compute_classification(obj):
+    callable_names = []
+    noncallable_names = []
+    for x in sorted(dir(obj)):
+        try:
+            is_callable = callable(getattr(obj, x))
+        except AttributeError:
+            is_callable = False  # Listed by dir(), but not actually there (e.g., type.__abstractmethods__)
+        if is_callable:
+            callable_names.append(x)
+        else:
+            noncallable_names.append(x)
+    return tuple(callable_names), tuple(noncallable_names)
+
+
+def _classify(obj, static=False):
+    """
+    Classifies every attribute of obj in one pass (a single dir(), a single getattr() per attribute). Only names are
+    kept, no values, so the cache doesn't keep anything alive (e.g., a class, via its own descriptors).
+
+    :param static: (bool) Classify without invoking anything, see kinds()
+    :return: (tuple) (sorted tuple of the names of callable attributes, sorted tuple of the names of the others)
+    """
+    if static:
+        return _cached(_static_cache, obj, _compute_static_classification)[0]
+    return _cached(_cache, obj, _compute_classification)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Static mode. getattr() runs properties, descriptors and __getattr__ hooks, which on lazy-loading objects (e.g.,
+# Selenium WebElements, ORM models) can mean a network round trip or a query per attribute. In static mode attributes
+# are looked up with inspect.getattr_static() instead (and listed without calling a custom __dir__), so nothing is
+# invoked. Each attribute gets one of these kinds..
+#
+#     'method'        a function or method (found on the class)
+#     'function'      a function (of a module)
+#     'classmethod'   a classmethod
+#     'staticmethod'  a staticmethod
+#     'class'         a class
+#     'property'      a property
+#     'descriptor'    any other descriptor (e.g., slots, C-level attributes) - its value is only known by invoking it
+#     'data'          a plain value
+#     'unavailable'   listed, but not found
+#
+# Properties and descriptors count as non-callables in static mode (their values can't be known without invoking them).
+
+_CALLABLE_KINDS = frozenset(['method', 'function', 'classmethod', 'staticmethod', 'class'])
+
+_METHOD_TYPES = (types.FunctionType, types.BuiltinFunctionType, types.MethodType, types.MethodDescriptorType,
+                 types.WrapperDescriptorType, types.MethodWrapperType, types.ClassMethodDescriptorType)
+
+
+def _static_kind(obj, value):
+    """
+    :param obj: The object being inspected
+    :param value: An attribute of obj, as returned by inspect.getattr_static()
+    :return: (str) The kind of attribute (see above)
+    """
+    if isinstance(value, classmethod):
+        return 'classmethod'
+    if isinstance(value, staticmethod):
+        return 'staticmethod'
+    if isinstance(value, type):
+        return 'class'
+    if isinstance(value, _METHOD_TYPES):
+        return 'function' if issubclass(type(obj), types.ModuleType) else 'method'
+    if isinstance(value, property):
+        return 'property'
+    if hasattr(type(value), '__get__'):
+        return 'descriptor'
+    return 'data'
+
+
+def _compute_static_classification(obj):
+    if issubclass(type(obj), type):
+        names = type.__dir__(obj)
+    else:
+        # (Like object.__dir__(), minus its plain lookup of obj.__dict__, which would run __getattr__ if there's none)
+        try:
+            instance_dict = object.__getattribute__(obj, '__dict__')
+        except AttributeError:
+            instance_dict = {}
+        names = list(instance_dict) + type.__dir__(type(obj))
+    attribute_kinds = {}
+    callable_names = []
+    noncallable_names = []
+    for x in sorted(set(names)):
+        try:
+            kind = _static_kind(obj, inspect.getattr_static(obj, x))
+        except AttributeError:
+            kind = 'unavailable'
+        attribute_kinds[x] = kind
+        if kind in _CALLABLE_KINDS:
+            callable_names.append(x)
+        else:
+            noncallable_names.append(x)
+    return (tuple(callable_names), tuple(noncallable_names)), attribute_kinds
+
+
+def kinds(obj):
+    """
+    Static mode: classify every attribute of obj without invoking any property, descriptor or __getattr__ hook.
+
+    :return: (dict) Attribute name -> kind (see above), in name order
+    """
+    return dict(_cached(_static_cache, obj, _compute_static_classification)[1])
+
 
 def everything(obj):
     return (sorted([x for x in dir(obj)]))
 
 
-def callables(obj):
-    return(sorted([x for x in dir(obj) if callable(getattr(obj,x))]))
+def partition(obj, static=False):
+    """
+    :param static: (bool) Classify without invoking anything, see kinds()
+    :return: (tuple) (callables(obj), noncallables(obj)), computed together in a single pass
+    """
+    callable_names, noncallable_names = _classify(obj, static)
+    return list(callable_names), list(noncallable_names)
+
+
+def callables(obj, static=False):
+    return list(_classify(obj, static)[0])
 
 
-def noncallables(obj):
-    return(sorted(set(everything(obj)) - set(callables(obj))))
+def noncallables(obj, static=False):
+    return list(_classify(obj, static)[1])
 
 
-def show_callables(obj):
+def show_callables(obj, static=False):
     print("\ncallables...")
-    for x in callables(obj):
+    for x in callables(obj, static):
         print(f"    {x}")
 
 
-def show_noncallables(obj):
+def show_noncallables(obj, static=False):
     print("\nnon-callables...")
-    for x in noncallables(obj):
-        y = getattr(obj,x)
-        print(f"    {x}: {y}")
+    if static:
+        attribute_kinds = kinds(obj)
+    for x in noncallables(obj, static):
+        if static:
+            kind = attribute_kinds[x]
+            if kind == 'data':
+                print(f"    {x}: {inspect.getattr_static(obj, x)}")
+            else:
+                print(f"    {x}: <{kind}>")
+        else:
+            y = getattr(obj, x, '<unavailable>')
+            print(f"    {x}: {y}")
+
+
+def show_kinds(obj):
+    print("\nattributes (static)...")
+    for x, kind in kinds(obj).items():
+        print(f"    {x}: {kind}")
 
 
 def show_docstring(obj):
@@ -47,7 +248,329 @@ def show_docstring(obj):
         print(line)
 
 
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Memory footprint. footprint() walks everything reachable from an object (iteratively, so deep structures don't hit
+# the recursion limit, and each object is counted once, so cycles and sharing are fine) and sums sys.getsizeof().
+# Each object is attributed to the first (shortest) path that reaches it, which gives every object a subtree, and a
+# subtree size. Classes, modules and functions are shared, global things: they're neither counted nor walked into.
+#
+#     fp = insp.footprint(session, max_depth=20)
+#     print(fp.total_size, fp.object_count)
+#     insp.show_footprint(session)
+
+_FOOTPRINT_SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+                         types.CodeType, types.MethodDescriptorType, types.WrapperDescriptorType)
+_FOOTPRINT_ATOMIC_TYPES = (str, bytes, bytearray, int, float, complex, bool, type(None), range)
+
+
+class Footprint:
+    """
+    Result of footprint()..
+
+        total_size    (int)  Sum of sys.getsizeof() over all objects reached (bytes)
+        object_count  (int)  Number of objects reached
+        truncated     (bool) Whether the walk was cut short by max_objects or max_size
+        by_type       (dict) Type name -> (count, total size), largest total size first
+        by_path       (dict) Attribute path -> subtree size, for the paths up to path_depth levels deep
+        largest       (list) The top_n largest subtrees (root excluded) as (subtree size, path, type name), largest first
+    """
+
+    def __init__(self):
+        self.total_size = 0
+        self.object_count = 0
+        self.truncated = False
+        self.by_type = {}
+        self.by_path = {}
+        self.largest = []
+
+
+def _footprint_children(obj):
+    """
+    :return: (iterable) (edge label, child) pairs for the objects directly referenced by obj. An edge label is a
+             (kind, key) tuple, turned into text by _edge_text() only when needed.
+    """
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            yield ('key', key), key
+            yield ('item', key), value
+        return
+    if isinstance(obj, (list, tuple)):
+        for index, value in enumerate(obj):
+            yield ('item', index), value
+        return
+    if isinstance(obj, (set, frozenset)):
+        for value in obj:
+            yield ('member', value), value
+        return
+
+    handled = False
+    try:
+        instance_dict = object.__getattribute__(obj, '__dict__')
+    except (AttributeError, TypeError):
+        instance_dict = None
+    if type(instance_dict) is dict:
+        handled = True
+        yield ('dict', None), instance_dict
+    for cls in type(obj).__mro__:
+        for slot in cls.__dict__.get('__slots__', ()):
+            if slot in ('__dict__', '__weakref__'):
+                continue
+            handled = True
+            try:
+                yield ('attr', slot), object.__getattribute__(obj, slot)
+            except AttributeError:
+                pass  # Empty slot
+    if not handled:
+        for referent in gc.get_referents(obj):
+            yield ('ref', None), referent
+
+
+def _edge_text(label):
+    kind, key = label
+    if kind == 'attr':
+        return f".{key}"
+    if kind in ('item', 'key', 'member'):
+        key_repr = repr(key)
+        key_repr = key_repr if len(key_repr) <= 40 else key_repr[:37] + '...'
+        if kind == 'item':
+            return f"[{key_repr}]"
+        return f"<key {key_repr}>" if kind == 'key' else f"{{{key_repr}}}"
+    return "<ref>"
+
+
+def footprint(obj, max_depth=None, max_objects=None, max_size=None, path_depth=2, top_n=20):
+    """
+    Measures the memory used by obj and everything reachable from it (see above).
+
+    :param obj: The object to measure
+    :param max_depth: (int) Don't walk more than this many references away from obj (default: no limit)
+    :param max_objects: (int) Stop after this many objects (default: no limit)
+    :param max_size: (int) Stop once this many bytes have been counted (default: no limit)
+    :param path_depth: (int) How many levels of attribute paths to report in by_path
+    :param top_n: (int) How many subtrees to report in largest
+    :return: (Footprint) The measurements
+    """
+    result = Footprint()
+    parents = [-1]
+    labels = [None]
+    depths = [0]
+    sizes = []
+    type_names = []
+    by_type = {}
+    seen = {id(obj)}
+    pending = collections.deque([(obj, 0)])
+
+    while pending:
+        current, index = pending.popleft()
+        size = sys.getsizeof(current, 0)
+        if isinstance(current, _FOOTPRINT_ATOMIC_TYPES):
+            children = ()
+        else:
+            children = _footprint_children(current)
+        # An instance's __dict__ is part of the instance, its items are the instance's attributes
+        expanded = []
+        for label, child in children:
+            if label[0] == 'dict':
+                if id(child) in seen:
+                    continue
+                seen.add(id(child))
+                size += sys.getsizeof(child, 0)
+                expanded.extend((('attr', key), value) for key, value in child.items())
+            else:
+                expanded.append((label, child))
+        sizes.append(size)
+        type_name = type(current).__qualname__
+        type_names.append(type_name)
+        count_size = by_type.get(type_name)
+        by_type[type_name] = (1, size) if count_size is None else (count_size[0] + 1, count_size[1] + size)
+        result.total_size += size
+        result.object_count += 1
+        if (max_objects is not None and result.object_count >= max_objects) or \
+                (max_size is not None and result.total_size >= max_size):
+            result.truncated = bool(pending) or bool(expanded)
+            break
+        depth = depths[index] + 1
+        if max_depth is not None and depth > max_depth:
+            continue
+        for label, child in expanded:
+            if id(child) in seen or isinstance(child, _FOOTPRINT_SKIP_TYPES):
+                continue
+            seen.add(id(child))
+            parents.append(index)
+            labels.append(label)
+            depths.append(depth)
+            pending.append((child, len(parents) - 1))
+
+    # Objects queued but not measured (walk cut short) don't count
+    measured = len(sizes)
+
+    # Subtree sizes: each object's size is added to all of its ancestors' (children always come after their parents)
+    subtree_sizes = list(sizes)
+    for index in range(measured - 1, 0, -1):
+        subtree_sizes[parents[index]] += subtree_sizes[index]
+
+    paths = {0: ''}
+
+    def path_of(index):
+        edges = []
+        while index not in paths:
+            edges.append(index)
+            index = parents[index]
+        path = paths[index]
+        for index in reversed(edges):
+            path = paths[index] = path + _edge_text(labels[index])
+        return path
+
+    result.by_type = dict(sorted(by_type.items(), key=lambda item: item[1][1], reverse=True))
+    result.by_path = {path_of(index) or '(root)': subtree_sizes[index]
+                      for index in range(measured) if depths[index] <= path_depth}
+    result.largest = [(subtree_sizes[index], path_of(index), type_names[index])
+                      for index in heapq.nlargest(top_n, range(1, measured), key=subtree_sizes.__getitem__)]
+    return result
+
+
+def show_footprint(obj, top_n=20, **kwargs):
+    """
+    Prints the footprint() of obj: totals, the top_n types, and the top_n largest subtrees. Other keyword arguments
+    are passed on to footprint().
+    """
+    fp = footprint(obj, top_n=top_n, **kwargs)
+    truncated = ' (truncated)' if fp.truncated else ''
+    print(f"\nfootprint: {fp.total_size} bytes in {fp.object_count} objects{truncated}")
+    print("\nby type...")
+    for type_name, (count, size) in list(fp.by_type.items())[:top_n]:
+        print(f"    {size:12d} {count:9d}  {type_name}")
+    print("\nlargest subtrees...")
+    for size, path, type_name in fp.largest:
+        print(f"    {size:12d}  {path}  ({type_name})")
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Package scan, for API inventories of whole dependency trees. Modules are imported and inspected (in static mode, see
+# kinds()) by a pool of worker processes, and a JSONL record is written for every class and function as soon as its
+# module is done, one module at a time, rather than building the whole inventory in memory..
+#
+#     with open('selenium_api.jsonl', 'w') as f:
+#         insp.scan('selenium', output=f, workers=8)
+#
+# Or from the command line..
+#
+#     python rmbinspect.py --scan selenium PIL --workers 8 > api.jsonl
+#
+# Record fields: module, name, type ('class' or 'function'), and bases and attributes (name -> kind) for classes, or
+# signature for functions. A module that fails to import gets a single record with module and error.
+
+
+def scan_modules(targets):
+    """
+    :param targets: (str or list) Names of packages and/or modules
+    :return: (list) The names of the modules and all of their submodules (packages are imported to find those)
+    """
+    if isinstance(targets, str):
+        targets = [targets]
+    names = []
+    for target in targets:
+        names.append(target)
+        try:
+            module = _import_quietly(target)
+        except Exception:
+            continue  # Reported when scanned
+        if hasattr(module, '__path__'):
+            with _stdout_to_devnull():  # (walk_packages imports the subpackages)
+                names.extend(info.name for info in pkgutil.walk_packages(module.__path__, prefix=f"{target}.",
+                                                                         onerror=lambda name: None)
+                             if info.name.rpartition('.')[2] != '__main__')  # (Importing those runs a CLI)
+    return list(dict.fromkeys(names))
+
+
+@contextlib.contextmanager
+def _stdout_to_devnull():
+    """
+    Context manager: whatever is printed inside it (e.g., by modules on import) goes to os.devnull rather than stdout,
+    where the JSONL records go.
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _import_quietly(module_name):
+    with _stdout_to_devnull():
+        return importlib.import_module(module_name)
+
+
+def _scan_module(module_name):
+    """
+    :return: (list) The records for the classes and functions defined in the module (see above)
+    """
+    try:
+        module = _import_quietly(module_name)
+    except BaseException as e:
+        return [{'module': module_name, 'error': f"{type(e).__name__}: {e}"}]
+    records = []
+    for name, kind in kinds(module).items():
+        if kind not in ('class', 'function'):
+            continue
+        obj = inspect.getattr_static(module, name)
+        if getattr(obj, '__module__', None) != module_name:
+            continue  # Imported from elsewhere
+        record = {'module': module_name, 'name': name, 'type': kind}
+        if kind == 'class':
+            record['bases'] = [f"{base.__module__}.{base.__qualname__}" for base in obj.__bases__]
+            record['attributes'] = kinds(obj)
+        else:
+            try:
+                record['signature'] = str(inspect.signature(obj))
+            except (TypeError, ValueError):
+                record['signature'] = None
+        records.append(record)
+    return records
+
+
+def iter_scan(targets, workers=None):
+    """
+    :param targets: (str or list) Names of packages and/or modules
+    :param workers: (int) Number of worker processes (default: one per CPU; 1 scans in this process)
+    :return: (generator) Yields the records (dicts, see above) module by module, in order of completion
+    """
+    module_names = scan_modules(targets)
+    if workers == 1:
+        for module_name in module_names:
+            yield from _scan_module(module_name)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_scan_module, module_name) for module_name in module_names]
+        for future in concurrent.futures.as_completed(futures):
+            yield from future.result()
+
+
+def scan(targets, output=None, workers=None):
+    """
+    Writes a JSONL record (see above) for every class and function of the target packages/modules.
+
+    :param targets: (str or list) Names of packages and/or modules
+    :param output: (file) Where the JSONL goes (default: sys.stdout)
+    :param workers: (int) Number of worker processes (default: one per CPU; 1 scans in this process)
+    :return: (int) The number of records written
+    """
+    if output is None:
+        output = sys.stdout
+    count = 0
+    for record in iter_scan(targets, workers):
+        output.write(json.dumps(record, default=repr) + '\n')
+        count += 1
+    output.flush()
+    return count
+
+
 if __name__ == '__main__':
-    show_callables(str)
-    show_noncallables(str)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scan", nargs='+', default=None, metavar='PACKAGE', help="Write a JSONL API inventory of these packages/modules")
+    parser.add_argument("--workers", default=None, type=int)
+    cmdline_args = parser.parse_args()
+
+    if cmdline_args.scan is not None:
+        scan(cmdline_args.scan, workers=cmdline_args.workers)
+    else:
+        show_callables(str)
+        show_noncallables(str)
 
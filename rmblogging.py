@@ -4,11 +4,16 @@ RMB's logging module
 """
 
 import argparse
-import inspect
+import atexit
+import multiprocessing
+import queue
 import sys
-from datetime import datetime
-from enum import IntEnum
-from functools import partial
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from enum import Enum, IntEnum
+from functools import partial, wraps
 
 
 class LogLevels(IntEnum):
@@ -27,7 +32,21 @@ class LogLevels(IntEnum):
     DEBUG = 7        # debug-level message
 
 
-class Rmblogging:
+class _RmbloggingMeta(type):
+    """
+    Metaclass for Rmblogging. Settings are changed by assigning directly to the class attributes (e.g.,
+    Rmblogging.SHOW_MICROSECONDS = True), so any such assignment throws away the compiled formatter and the table of
+    per-module effective levels. Both are rebuilt by logmsg() as needed.
+    """
+
+    def __setattr__(cls, name, value):
+        super().__setattr__(name, value)
+        if not name.startswith('_'):
+            super().__setattr__('_formatter', None)
+            super().__setattr__('_effective_levels', {})
+
+
+class Rmblogging(metaclass=_RmbloggingMeta):
 
     # Defaults for logging..
     loglevel = LogLevels.DEBUG
@@ -37,9 +56,210 @@ class Rmblogging:
     FIXED_LEVEL_LEN_ENABLED = True  # Whether to truncate the log level in the log line's prefix
     FIXED_LEVEL_LEN_LEN = 5
     print_func = print
+    sink = None  # Optional structured sink (e.g., rmblogsink.MmapSegmentSink). If set, it gets the records instead of print_func.
+    RATE_LIMIT = None  # Optional (count, seconds): at most count messages per call site per that many seconds
+    COLLAPSE_REPEATS = False  # Whether to collapse identical consecutive messages into a "repeated N times" summary
+    SUPPRESSION_REPORT_INTERVAL = 10.0  # Seconds between reports of ongoing suppression (RATE_LIMIT, COLLAPSE_REPEATS)
+    SPAN_REPORT_LEVEL = LogLevels.INFO  # Level at which timing span summaries are logged (see Span)
+    SPAN_REPORT_INTERVAL = None  # If set, seconds between timing span summaries
+    SPAN_REPORT_AT_EXIT = False  # Whether to log a timing span summary at exit
+
+    # Internal state (not settings)..
+    _formatter = None  # The _CompiledFormatter for the current settings, built on demand by logmsg()
+    _queued_writer = None  # The active QueuedWriter, see start_queued_writer()
+    _log_collector = None  # The active LogCollector, see start_log_collector()
+    _flight_recorder = None  # deque of raw (level, monotonic_ns, msg, args) records, see start_flight_recorder()
+    _flight_recorder_level = LogLevels.DEBUG
+    _module_levels = {}  # Per-module/per-logger levels, see set_module_level()
+    _effective_levels = {}  # Module name -> effective level, resolved from the above on demand
+
+    @classmethod
+    def is_enabled(cls, level, module=None):
+        """
+        Cheap guard for call sites that would do expensive work just to build a log message..
+
+            if Rmblogging.is_enabled(LogLevels.DEBUG):
+                debug(f"{huge_structure = }")
+
+        :param level: (LogLevels) Logging level
+        :param module: (str) Name of the module (or logger) whose level applies (default: the caller's module)
+        :return: (bool) True if messages of this level are currently printed
+        """
+        if not cls._module_levels:
+            return level <= cls.loglevel
+        if module is None:
+            module = _caller_module()
+        return level <= _effective_level(module)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Per-module (per-logger) levels. A level set for a dotted name also applies to everything below it, e.g. a level set
+# for 'pkg' applies to 'pkg.sub' too, unless 'pkg.sub' has a level of its own. Modules without a level of their own
+# use Rmblogging.loglevel.
+#
+#     Rmblogging.loglevel = LogLevels.NOTICE
+#     set_module_level('rmbselenium', LogLevels.DEBUG)
+#
+# Effective levels are resolved once per module and cached in Rmblogging._effective_levels, so the hot path is a single
+# dict lookup and an integer compare. The cache is replaced whenever any level changes.
+
+
+def set_module_level(name, level):
+    """
+    :param name: (str) Module (or logger) name, e.g. 'rmbselenium'
+    :param level: (LogLevels) Logging level for that module, or None to go back to the default
+    """
+    module_levels = dict(Rmblogging._module_levels)
+    if level is None:
+        module_levels.pop(name, None)
+    else:
+        module_levels[name] = LogLevels(level)
+    Rmblogging._module_levels = module_levels
+    Rmblogging._effective_levels = {}
+
+
+def clear_module_levels():
+    """
+    Remove every per-module level, so that Rmblogging.loglevel applies everywhere again.
+    """
+    Rmblogging._module_levels = {}
+    Rmblogging._effective_levels = {}
+
+
+def _effective_level(module):
+    """
+    :param module: (str) Module name
+    :return: (LogLevels) The level in effect for that module
+    """
+    effective_levels = Rmblogging._effective_levels
+    try:
+        return effective_levels[module]
+    except KeyError:
+        pass
+    level = Rmblogging.loglevel
+    name = module or ''
+    while name:
+        if name in Rmblogging._module_levels:
+            level = Rmblogging._module_levels[name]
+            break
+        name = name.rpartition('.')[0]
+    effective_levels[module] = level
+    return level
+
+
+def _caller_frame():
+    """
+    :return: (frame) The frame that called into rmblogging (frames of this module itself are skipped)
+    """
+    frame = sys._getframe(1)
+    while frame.f_globals is _THIS_MODULE_GLOBALS and frame.f_back is not None:
+        frame = frame.f_back
+    return frame
+
+
+def _caller_module():
+    """
+    :return: (str) Name of the module that called into rmblogging (frames of this module itself are skipped)
+    """
+    return _caller_frame().f_globals.get('__name__')
+
 
+_THIS_MODULE_GLOBALS = globals()
 
-def logmsg(level, msg):
+
+class _CompiledFormatter:
+    """
+    Builds the "[LEVEL TIMESTAMP]" prefix of each log line. Everything that only depends on the Rmblogging settings
+    (the padded/truncated level names) is computed once, in __init__. The '%Y-%m%d-%H%M%S' part of the timestamp is
+    cached and only re-formatted when the wall-clock second changes. Microseconds (if enabled) are appended per call.
+    """
+
+    def __init__(self):
+        self.show_microseconds = Rmblogging.SHOW_MICROSECONDS
+        self.level_strs = {}
+        for level in LogLevels:
+            level_str = level.name
+            if Rmblogging.FIXED_LEVEL_LEN_ENABLED:
+                format_specifier_a = "{:d}.{:d}s".format(Rmblogging.FIXED_LEVEL_LEN_LEN, Rmblogging.FIXED_LEVEL_LEN_LEN)
+                format_specifier_b = "{:"+format_specifier_a+"}"
+                level_str = format_specifier_b.format(level_str)
+            self.level_strs[level] = level_str
+        self.cached_timestamp = (None, '')  # (epoch second, formatted timestamp for that second)
+
+    def timestamp(self, now_ns=None):
+        """
+        :param now_ns: (int) Epoch time in nanoseconds to be formatted (default: the current time)
+        :return: (str) The formatted timestamp, e.g. '2024-0131-235959' or '2024-0131-235959.123456'
+        """
+        if now_ns is None:
+            now_ns = time.time_ns()
+        seconds, nanoseconds = divmod(now_ns, 1_000_000_000)
+        cached_seconds, formatted = self.cached_timestamp
+        if seconds != cached_seconds:
+            formatted = time.strftime('%Y-%m%d-%H%M%S', time.localtime(seconds))
+            self.cached_timestamp = (seconds, formatted)
+        if self.show_microseconds:
+            return f"{formatted}.{nanoseconds // 1000:06d}"
+        return formatted
+
+    def prefix(self, level, now_ns=None):
+        """
+        :param level: (LogLevels) Logging level
+        :param now_ns: (int) Epoch time in nanoseconds (default: the current time)
+        :return: (str) The "[LEVEL TIMESTAMP]" that starts each log line
+        """
+        return f"[{self.level_strs[level]} {self.timestamp(now_ns)}]"
+
+
+def _get_formatter():
+    """
+    :return: (_CompiledFormatter) The formatter for the current Rmblogging settings, (re)building it if needed.
+    """
+    formatter = Rmblogging._formatter
+    if formatter is None:
+        formatter = Rmblogging._formatter = _CompiledFormatter()
+    return formatter
+
+
+class lazy:
+    """
+    Marks a zero-argument callable as a message that is only built if it is logged..
+
+        debug(lazy(lambda: f"{completed_process = }"))
+        debug(lazy(partial(expensive_repr, x)))
+
+    (Any other callable passed as a message, a function or class say, is logged as itself.)
+    """
+
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        """
+        :param func: (callable) Returns the message
+        """
+        self.func = func
+
+    def __call__(self):
+        return self.func()
+
+    def __repr__(self):
+        return f"lazy({self.func!r})"
+
+
+def _render(msg, args):
+    """
+    :param msg: (str or lazy) A message, a %-style template, or a lazy() message
+    :param args: (tuple) Arguments for a %-style template (a msg without args is used as-is, '%' characters and all)
+    :return: (str) The message
+    """
+    if isinstance(msg, lazy):
+        return msg.func()
+    if args:
+        return msg % args
+    return msg
+
+
+def logmsg(level, msg, *args):
     """
     Primitive to write a log message for various levels, using a well-defined format for each log line..
 
@@ -55,12 +275,14 @@ def logmsg(level, msg):
     Parameters and return values..
 
     :param level: (LogLevels) Logging level
-    :param msg: (str) The message to be displayed
+    :param msg: (str) The message to be displayed. May also be a %-style template (formatted with args), or a
+                lazy() message. Either way, the message is only built if the level is enabled, e.g.
+                debug("%r", completed_process) or debug(lazy(lambda: f"{completed_process = }"))
+    :param args: Arguments for a %-style template in msg
     :return: (Nothing is returned)
 
     The following interal variables are used..
 
-        level_str       (str)  The human-readable representation of the log level.
         msg_prefix      (str)  The "[LEVEL TIMESTAMP]" that starts each log line.
         msg_suffix      (str)  The "[CALLER]" displayed right-justified at the end of each log line.
         filler          (str)  A string of spaces used to push msg_suffix to its right-justified starting column.
@@ -68,26 +290,64 @@ def logmsg(level, msg):
     """
 
     # Don't print messages if their loglevel isn't currently enabled..
-    if level > Rmblogging.loglevel:
+    if Rmblogging._module_levels:
+        threshold = _effective_level(_caller_module())
+    else:
+        threshold = Rmblogging.loglevel
+    if level > threshold:
+        # ..but keep them (raw, unformatted) in the flight recorder, if it's running
+        if Rmblogging._flight_recorder is not None and level <= Rmblogging._flight_recorder_level:
+            Rmblogging._flight_recorder.append((level, time.monotonic_ns(), msg, args))
         return
 
-    # Format the log line..
+    # Rate limiting and collapsing of repeats (never applied to ERROR and up, which raise anyway, nor to multi-line
+    # reports - see unsuppressed())..
+    suppressible = level > LogLevels.ERROR and not getattr(_suppression_thread, 'exempt', 0)
+    if Rmblogging.RATE_LIMIT is not None and suppressible and _rate_limited(level):
+        return
+
+    msg = _render(msg, args)
 
-    level_str = level.name
-    if Rmblogging.FIXED_LEVEL_LEN_ENABLED:
-        format_specifier_a = "{:d}.{:d}s".format(Rmblogging.FIXED_LEVEL_LEN_LEN, Rmblogging.FIXED_LEVEL_LEN_LEN)
-        format_specifier_b = "{:"+format_specifier_a+"}"
-        level_str = format_specifier_b.format(level_str)
+    if Rmblogging.COLLAPSE_REPEATS and suppressible and _is_repeat(level, msg):
+        return
 
-    now = datetime.now()
-    myformatted_timestamp_now = f"{now.strftime('%Y-%m%d-%H%M%S')}"
-    if Rmblogging.SHOW_MICROSECONDS:
-        myformatted_timestamp_now += '.' + f'{now.microsecond:06d}'
+    caller = current_method_name() if Rmblogging.SHOW_CALLERNAME or Rmblogging.sink is not None else None
+    _write(level, msg, caller)
 
-    msg_prefix = f"[{level_str} {myformatted_timestamp_now}]"
 
-    if Rmblogging.SHOW_CALLERNAME:
-        msg_suffix = f"[{current_method_name()}]"
+def _write(level, msg, caller=None):
+    """
+    Write a (rendered) message, to Rmblogging.sink if set, or else as a log line via Rmblogging.print_func.
+
+    :param level: (LogLevels) Logging level
+    :param msg: (str) The message
+    :param caller: (str) The name of the calling function, or None
+    """
+
+    # A structured sink gets the raw fields, no need to format a line..
+    if Rmblogging.sink is not None:
+        Rmblogging.sink.write_record(level, time.time_ns(), caller or '', msg)
+        return
+
+    # Format and print the log line..
+    Rmblogging.print_func(_format_line(level, msg, caller if Rmblogging.SHOW_CALLERNAME else None))
+
+
+def _format_line(level, msg, caller=None, now_ns=None):
+    """
+    :param level: (LogLevels) Logging level
+    :param msg: (str) The message
+    :param caller: (str) The name of the calling function, or None to leave out the "[CALLER]" suffix
+    :param now_ns: (int) Time of the message, in nanoseconds since the epoch (default: the current time)
+    :return: (str) The log line, "[LEVEL TIMESTAMP] MESSAGE [CALLER]"
+    """
+
+    # Format the log line (the level strings and timestamp formatting are precompiled, see _CompiledFormatter)..
+
+    msg_prefix = _get_formatter().prefix(level, now_ns)
+
+    if caller is not None:
+        msg_suffix = f"[{caller}]"
         filler = ' '*(Rmblogging.MAX_COLUMNS - len(msg_prefix) - len(msg_suffix) - len(msg) - 1)
         # Workaround for this module's current lack of support for multiline messages (msg_suffix was getting appended immediately adjacent to the output of the last line. Just skip the suffix if there's not enough room)
         if len(filler) <= 8:
@@ -95,12 +355,14 @@ def logmsg(level, msg):
     else:
         filler = msg_suffix = ''
 
-    # Print the log line..
-    Rmblogging.print_func(f"{msg_prefix} {msg}{filler}{msg_suffix}")
+    return f"{msg_prefix} {msg}{filler}{msg_suffix}"
 
 
-def logmsg_and_raise_exception(level, msg):
+def logmsg_and_raise_exception(level, msg, *args):
+    msg = _render(msg, args)
+    dump_flight_recorder()  # The context leading up to the error goes out first
     logmsg(level, msg)
+    flush_queued_writer()  # Make sure the message is out before the exception unwinds (and possibly ends) the program
     raise RuntimeError(msg)
 
 
@@ -130,28 +392,805 @@ debug = partial(logmsg, LogLevels.DEBUG)
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
 
+# Functions whose frames are never reported as the caller. The module's own wrappers are matched by code object (see
+# _WRAPPER_CODES, filled in below), anything else by name. Note the partials (debug(), info(), etc.) don't have frames
+# of their own, but user-defined functions with these names are skipped too, as they always have been.
+_WRAPPER_NAMES = frozenset(['logmsg', 'debug', 'info', 'warning', 'error'])
+_WRAPPER_CODES = set()
+
+# Memoized caller names, keyed by code object. The value is None for wrapper frames that are to be skipped.
+_caller_names = {}
+
+
+def _caller_name(code):
+    """
+    :param code: (code) The code object of a frame on the calling stack
+    :return: (str) The formatted name of the function (e.g., 'doit()'), or None if it is a wrapper to be skipped.
+    """
+    try:
+        return _caller_names[code]
+    except KeyError:
+        pass
+    if code in _WRAPPER_CODES or code.co_name in _WRAPPER_NAMES:
+        name = None
+    else:
+        # I like to add a '()' to the end of the method name
+        name = f"{code.co_name}()"
+    _caller_names[code] = name
+    return name
+
+
 def current_method_name():
     """
-    Inspects the calling stack, locating the name of the caller's caller. NOTE: Certain utility functions (e.g., logmsg(), info(),
+    Walks the calling stack, locating the name of the caller's caller. NOTE: Certain utility functions (e.g., logmsg(), info(),
     debug(), etc.) are ignored since 99.999% of the time we're truly interested in who called the utility, not the utility itself.
 
+    The stack is walked via sys._getframe()/f_back rather than inspect.stack(), which builds a FrameInfo (and reads
+    source lines from disk) for every frame on the stack. Names are memoized per code object.
+
     :return: (str) The name of the calling function.
     """
 
-    stack_iter = iter(inspect.stack())
-    stack_iter.__next__()  # Eat the first one, it is this method, which we don't care about
-    caller = stack_iter.__next__()
+    frame = sys._getframe(1)  # Skip the first one, it is this method, which we don't care about
+    name = _caller_name(frame.f_code)
 
     # We also don't care about some utility methods ... we're really interested in the caller of those utility methods
-    while caller.function in ['logmsg', 'debug', 'info', 'warning', 'error']:
+    while name is None:
+        if frame.f_back is None:
+            # Nothing but wrappers on the stack, report the outermost one
+            return f"{frame.f_code.co_name}()"
+        frame = frame.f_back
+        name = _caller_name(frame.f_code)
+
+    return name
+
+
+_WRAPPER_CODES.update([logmsg.__code__, logmsg_and_raise_exception.__code__])
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Queued (asynchronous) writer. Opt-in, via start_queued_writer(). Log lines are still formatted on the caller's
+# thread, but only appended to a queue there; a dedicated writer thread drains the queue and writes them in batches.
+#
+#     from rmblogging import start_queued_writer, OverflowPolicy
+#
+#     start_queued_writer(maxsize=50000, overflow=OverflowPolicy.DROP_OLDEST)
+
+
+class OverflowPolicy(Enum):
+    """
+    What QueuedWriter.put() does when the queue is full..
+    """
+    BLOCK = 'block'                    # wait for the writer thread to make room (nothing is lost)
+    DROP_OLDEST = 'drop-oldest'        # discard the oldest queued line to make room for the new one
+    DROP_AND_COUNT = 'drop-and-count'  # discard the new line, only counting it
+
+
+class QueuedWriter:
+    """
+    A bounded queue of preformatted log lines, drained by a background thread. Each batch of lines is written to the
+    stream with a single write() call, followed by a single flush().
+
+    Lines lost to the overflow policy are counted in 'dropped', and reported when the writer is stopped.
+    """
+
+    def __init__(self, stream=None, maxsize=10000, overflow=OverflowPolicy.BLOCK, max_batch=1000):
+        """
+        :param stream: (file) Where the log lines are written to (default: sys.stdout, as of when each batch is written)
+        :param maxsize: (int) Maximum number of lines in the queue
+        :param overflow: (OverflowPolicy) What to do when the queue is full (a policy's value, e.g. 'block', is accepted too)
+        :param max_batch: (int) Maximum number of lines per write() call
+        """
+        if maxsize < 1:
+            raise ValueError(f"QueuedWriter maxsize must be at least 1, got {maxsize}")
+        self.stream = stream
+        self.maxsize = maxsize
+        self.overflow = OverflowPolicy(overflow)
+        self.max_batch = max_batch
+        self.dropped = 0
+        self.previous_print_func = print  # Restored by stop_queued_writer()
+
+        self._lines = deque()
+        self._cond = threading.Condition()
+        self._queued_count = 0   # Number of lines ever queued
+        self._done_count = 0     # Number of queued lines that have since been written (or dropped)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='rmblogging-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, line):
+        """
+        Queue a single (preformatted) log line. Drop-in replacement for Rmblogging.print_func.
+
+        :param line: (str) The log line, without a trailing newline
+        """
+        with self._cond:
+            if not self._stopping and len(self._lines) >= self.maxsize:
+                if self.overflow is OverflowPolicy.BLOCK:
+                    while len(self._lines) >= self.maxsize and not self._stopping:
+                        self._cond.wait()
+                elif self.overflow is OverflowPolicy.DROP_OLDEST:
+                    self._lines.popleft()
+                    self._done_count += 1
+                    self.dropped += 1
+                else:
+                    self.dropped += 1
+                    return
+            if not self._stopping:
+                self._lines.append(line)
+                self._queued_count += 1
+                self._cond.notify_all()
+                return
+        # Stopping (or stopped): the writer thread may already be gone, so write the line here rather than lose it
+        self._write([line])
+
+    def flush(self, timeout=None):
+        """
+        Wait until every line queued so far has been written and flushed.
+
+        :param timeout: (float) Maximum number of seconds to wait (default: wait forever)
+        :return: (bool) True if everything was written, False if the timeout expired first
+        """
+        if threading.current_thread() is self._thread:
+            return True
+        with self._cond:
+            target = self._queued_count
+            return self._cond.wait_for(lambda: self._done_count >= target or not self._thread.is_alive(), timeout)
+
+    def stop(self, timeout=None):
+        """
+        Write out whatever is still queued, then stop the writer thread.
+
+        :param timeout: (float) Maximum number of seconds to wait for the writer thread (default: wait forever)
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        if self.dropped:
+            self._write([f"{_get_formatter().prefix(LogLevels.WARNING)} {self.dropped} log messages were dropped (queue full)"])
+
+    def _write(self, lines):
+        stream = self.stream if self.stream is not None else sys.stdout
         try:
-            caller = stack_iter.__next__()
-        except StopIteration:
-            break
-        # caller = frame[3]
+            stream.write('\n'.join(lines) + '\n')
+            stream.flush()
+        except (OSError, ValueError):
+            pass  # Nowhere left to report it (e.g., the stream was closed during interpreter shutdown)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._lines or self._stopping)
+                if not self._lines:
+                    return  # Stopping, and everything has been written
+                batch = [self._lines.popleft() for _ in range(min(len(self._lines), self.max_batch))]
+                self._cond.notify_all()  # There's room in the queue again
+            self._write(batch)
+            with self._cond:
+                self._done_count += len(batch)
+                self._cond.notify_all()
+
+
+def start_queued_writer(stream=None, maxsize=10000, overflow=OverflowPolicy.BLOCK, max_batch=1000):
+    """
+    Switch logging to asynchronous mode: Rmblogging.print_func is replaced by a QueuedWriter, whose background thread
+    writes to the stream. Any previously started queued writer is stopped (and flushed) first. The writer is also
+    stopped and flushed at exit.
+
+    Parameters are as for QueuedWriter.
+
+    :return: (QueuedWriter) The new writer
+    """
+    stop_queued_writer()
+    writer = QueuedWriter(stream=stream, maxsize=maxsize, overflow=overflow, max_batch=max_batch)
+    writer.previous_print_func = Rmblogging.print_func
+    Rmblogging._queued_writer = writer
+    Rmblogging.print_func = writer.put
+    return writer
+
+
+def stop_queued_writer():
+    """
+    Flush and stop the queued writer (if any), and go back to writing synchronously via the print_func that was in use
+    before start_queued_writer().
+    """
+    writer = Rmblogging._queued_writer
+    if writer is None:
+        return
+    Rmblogging._queued_writer = None
+    if Rmblogging.print_func == writer.put:
+        Rmblogging.print_func = writer.previous_print_func
+    writer.stop()
+
+
+def flush_queued_writer(timeout=None):
+    """
+    Wait until everything logged so far has been written. Does nothing if the queued writer isn't active.
+
+    :param timeout: (float) Maximum number of seconds to wait (default: wait forever)
+    """
+    writer = Rmblogging._queued_writer
+    if writer is not None:
+        writer.flush(timeout)
+
+
+atexit.register(stop_queued_writer)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Flight recorder. Opt-in, via start_flight_recorder(). Messages filtered out by the level check (e.g., DEBUG messages
+# while running at NOTICE) are kept in a fixed-size ring buffer, raw: level, monotonic timestamp, message template
+# and args. Nothing is formatted until the buffer is dumped, which happens automatically just before error(),
+# critical(), etc. raise, or when dump_flight_recorder() is called.
+#
+#     Rmblogging.loglevel = LogLevels.NOTICE
+#     start_flight_recorder(size=5000)
+#
+# NOTE: Since args are stored as references, a mutable argument that changes after the log call is dumped as it is at
+# dump time. Pass a snapshot (or an already formatted string) if that matters.
+
+
+def start_flight_recorder(size=10000, level=LogLevels.DEBUG):
+    """
+    Start (or resize) the flight recorder. Records already in the buffer are kept, up to the new size.
+
+    :param size: (int) Maximum number of records kept. The oldest records are discarded first.
+    :param level: (LogLevels) The most verbose level recorded. Disabled messages at or below it are recorded.
+    """
+    old_records = Rmblogging._flight_recorder or ()
+    Rmblogging._flight_recorder_level = level
+    Rmblogging._flight_recorder = deque(old_records, maxlen=size)
+
+
+def stop_flight_recorder():
+    """
+    Stop the flight recorder, discarding its records.
+    """
+    Rmblogging._flight_recorder = None
+
+
+def dump_flight_recorder():
+    """
+    Format and print (via Rmblogging.print_func) every record in the flight recorder, oldest first, then empty it.
+    Does nothing if the flight recorder isn't running or is empty.
+    """
+    recorder = Rmblogging._flight_recorder
+    if not recorder:
+        return
+    records = []
+    while recorder:
+        records.append(recorder.popleft())
+    formatter = _get_formatter()
+    sink = Rmblogging.sink
+
+    def emit(level, epoch_ns, msg):
+        if sink is not None:
+            sink.write_record(level, epoch_ns, 'flight_recorder()', msg)
+        else:
+            Rmblogging.print_func(f"{formatter.prefix(level, epoch_ns)} {msg}")
+
+    epoch_offset_ns = time.time_ns() - time.monotonic_ns()
+    emit(LogLevels.NOTICE, time.time_ns(), f"~~~ flight recorder: {len(records)} records ~~~")
+    for level, monotonic_ns, msg, args in records:
+        try:
+            msg = _render(msg, args)
+        except Exception as e:
+            msg = f"<unable to format {msg!r} with {args!r}: {e!r}>"
+        emit(level, monotonic_ns + epoch_offset_ns, msg)
+    emit(LogLevels.NOTICE, time.time_ns(), "~~~ end of flight recorder ~~~")
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Multi-process logging. Worker processes (multiprocessing, concurrent.futures.ProcessPoolExecutor) don't format or
+# write anything themselves: their log records are shipped over a multiprocessing queue to a single collector thread in
+# the parent, which formats and writes them (tagged with the worker's process name), so lines never interleave or tear.
+#
+#     collector = start_log_collector()
+#     with ProcessPoolExecutor(initializer=collector.initializer, initargs=collector.initargs) as pool:
+#         ...
+#     stop_log_collector()
+#
+# The workers use the parent's log levels as of when start_log_collector() was called.
+
+
+class _QueueSink:
+    """
+    Rmblogging.sink used in worker processes: puts each record on the collector's queue.
+    """
+
+    def __init__(self, record_queue, tag):
+        self.record_queue = record_queue
+        self.tag = tag
+
+    def write_record(self, level, epoch_ns, caller, msg):
+        self.record_queue.put((self.tag, int(level), epoch_ns, caller, msg))
+
+
+def init_worker_logging(record_queue, loglevel=None, module_levels=None, tag=None):
+    """
+    Pool initializer: send this (worker) process's log records to the collector in the parent. Normally passed to the
+    pool via LogCollector.initializer and LogCollector.initargs.
+
+    :param record_queue: (multiprocessing.Queue) The collector's queue
+    :param loglevel: (LogLevels) The log level to use in this process (default: leave as is)
+    :param module_levels: (dict) Per-module levels to use in this process (default: leave as is)
+    :param tag: (str) Tag identifying this process in the log lines (default: the process name)
+    """
+    Rmblogging._queued_writer = None  # Inherited through fork, but its thread isn't running here
+    if loglevel is not None:
+        Rmblogging.loglevel = LogLevels(loglevel)
+    if module_levels is not None:
+        Rmblogging._module_levels = dict(module_levels)
+        Rmblogging._effective_levels = {}
+    if tag is None:
+        tag = multiprocessing.current_process().name
+    Rmblogging.sink = _QueueSink(record_queue, tag)
+
+
+class LogCollector:
+    """
+    Receives the log records of worker processes (see init_worker_logging()) and formats and writes them via this
+    process's Rmblogging.print_func (or Rmblogging.sink, if set), from a background thread. Each batch of records
+    received is written in timestamp order.
+    """
+
+    def __init__(self, context=None, max_batch=1000):
+        """
+        :param context: (multiprocessing context) The context the pool uses (default: multiprocessing's default context)
+        :param max_batch: (int) Maximum number of records taken off the queue at a time
+        """
+        if context is None:
+            context = multiprocessing.get_context()
+        self.queue = context.Queue()
+        self.max_batch = max_batch
+        self._thread = threading.Thread(target=self._run, name='rmblogging-collector', daemon=True)
+        self._thread.start()
+
+    @property
+    def initializer(self):
+        return init_worker_logging
+
+    @property
+    def initargs(self):
+        return (self.queue, int(Rmblogging.loglevel), {name: int(level) for name, level in Rmblogging._module_levels.items()})
+
+    def stop(self, timeout=None):
+        """
+        Write out whatever has been received, then stop the collector thread. Call after the workers are done.
+
+        :param timeout: (float) Maximum number of seconds to wait for the collector thread (default: wait forever)
+        """
+        self.queue.put(None)
+        self._thread.join(timeout)
+
+    def _write(self, tag, level, epoch_ns, caller, msg):
+        level = LogLevels(level)
+        if Rmblogging.sink is not None:
+            Rmblogging.sink.write_record(level, epoch_ns, f"{tag}:{caller}", msg)
+        else:
+            caller = caller if Rmblogging.SHOW_CALLERNAME else None
+            Rmblogging.print_func(_format_line(level, f"[{tag}] {msg}", caller, epoch_ns))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [record for record in batch if record is not None]
+            batch.sort(key=lambda record: record[2])
+            for record in batch:
+                try:
+                    self._write(*record)
+                except Exception:
+                    pass  # A bad record mustn't kill the collector
+
+
+def start_log_collector(context=None, max_batch=1000):
+    """
+    Start collecting the log records of worker processes (replacing any previous collector, which is stopped). The
+    collector is also stopped at exit. Parameters are as for LogCollector.
+
+    :return: (LogCollector) The new collector. Pass its initializer and initargs to the process pool.
+    """
+    stop_log_collector()
+    collector = LogCollector(context=context, max_batch=max_batch)
+    Rmblogging._log_collector = collector
+    return collector
+
+
+def stop_log_collector():
+    """
+    Write out everything received from the worker processes, and stop the collector (if any).
+    """
+    collector = Rmblogging._log_collector
+    if collector is None:
+        return
+    Rmblogging._log_collector = None
+    collector.stop()
+
+
+atexit.register(stop_log_collector)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Suppression of noisy call sites, for retry loops, polling code and the like. Both are opt-in..
+#
+#     Rmblogging.RATE_LIMIT = (5, 60.0)     # At most 5 messages per call site (file/line) per 60 seconds
+#     Rmblogging.COLLAPSE_REPEATS = True    # "foo" x 1000 in a row -> "foo", then "last message repeated 999 times"
+#
+# Suppressed messages are only counted (a rate-limited message isn't even formatted). The counts are reported when
+# the call site's rate limit window ends (or the repeats end), at most every SUPPRESSION_REPORT_INTERVAL seconds while
+# suppression is ongoing, and at exit (or via report_suppressed()). ERROR and more severe messages are never suppressed,
+# and neither are messages logged inside unsuppressed() (as multi-line reports like report_spans() are).
+
+_suppression_lock = threading.Lock()
+_suppression_thread = threading.local()  # exempt: nesting depth of unsuppressed() in this thread
+_rate_limit_sites = {}  # (code, line number) -> [window start ns, messages in window, suppressed, last report ns, level]
+_last_message = [None, None, 0, 0]  # [level, msg, repeats not yet reported, last report ns]
+
+
+def _site_name(site):
+    code, lineno = site
+    return f"{code.co_name}() line {lineno}"
+
+
+def _rate_limited(level):
+    """
+    Count a message against its call site's rate limit.
+
+    :param level: (LogLevels) Logging level of the message
+    :return: (bool) True if the message is to be suppressed
+    """
+    max_count, interval = Rmblogging.RATE_LIMIT
+    frame = _caller_frame()
+    site = (frame.f_code, frame.f_lineno)
+    now_ns = time.monotonic_ns()
+    report = None
+    with _suppression_lock:
+        state = _rate_limit_sites.get(site)
+        if state is None:
+            state = _rate_limit_sites[site] = [now_ns, 0, 0, now_ns, level]
+        if now_ns - state[0] >= interval * 1_000_000_000:
+            if state[2]:
+                report = (state[4], state[2])
+            state[:4] = [now_ns, 0, 0, now_ns]
+        state[1] += 1
+        state[4] = level
+        suppressed = state[1] > max_count
+        if suppressed:
+            state[2] += 1
+            if now_ns - state[3] >= Rmblogging.SUPPRESSION_REPORT_INTERVAL * 1_000_000_000:
+                report = (level, state[2])
+                state[2] = 0
+                state[3] = now_ns
+    if report is not None:
+        _write(report[0], f"{report[1]} messages suppressed from {_site_name(site)} (rate limit: {max_count} per {interval}s)")
+    return suppressed
+
+
+def _is_repeat(level, msg):
+    """
+    :param level: (LogLevels) Logging level of the message
+    :param msg: (str) The (rendered) message
+    :return: (bool) True if the message repeats the previous one, and is to be suppressed
+    """
+    now_ns = time.monotonic_ns()
+    report = None
+    with _suppression_lock:
+        if _last_message[0] == level and _last_message[1] == msg:
+            _last_message[2] += 1
+            if now_ns - _last_message[3] >= Rmblogging.SUPPRESSION_REPORT_INTERVAL * 1_000_000_000:
+                report = (level, _last_message[2])
+                _last_message[2] = 0
+                _last_message[3] = now_ns
+            repeat = True
+        else:
+            if _last_message[2]:
+                report = (_last_message[0], _last_message[2])
+            _last_message[:] = [level, msg, 0, now_ns]
+            repeat = False
+    if report is not None:
+        _write(report[0], f"last message repeated {report[1]} times")
+    return repeat
+
+
+@contextmanager
+def unsuppressed():
+    """
+    Context manager: messages logged inside it (by this thread) are exempt from RATE_LIMIT and COLLAPSE_REPEATS.
+    For multi-line reports (e.g., report_spans()), whose lines all come from one call site and must not be cut off.
+    """
+    _suppression_thread.exempt = getattr(_suppression_thread, 'exempt', 0) + 1
+    try:
+        yield
+    finally:
+        _suppression_thread.exempt -= 1
+
+
+def report_suppressed():
+    """
+    Report (and reset) the counts of all messages suppressed so far by RATE_LIMIT and COLLAPSE_REPEATS.
+    """
+    reports = []
+    with _suppression_lock:
+        if _last_message[2]:
+            reports.append((_last_message[0], f"last message repeated {_last_message[2]} times"))
+            _last_message[2] = 0
+        for site, state in _rate_limit_sites.items():
+            if state[2]:
+                reports.append((state[4], f"{state[2]} messages suppressed from {_site_name(site)}"))
+                state[2] = 0
+    for level, msg in reports:
+        _write(level, msg)
+
+
+atexit.register(report_suppressed)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Timing spans. Durations (perf_counter_ns) of named spans are recorded in fixed-bucket histograms, in-process, and
+# summarized (count, total, p50/p95/p99, max) by report_spans(). Spans nest: a span entered while another one is
+# active is recorded under the outer span's path, e.g. 'login/sleep'.
+#
+#     with Span('login'):
+#         ...
+#
+#     @Span('resize')      # or just @timed, to use the function's name
+#     def resize(...):
+#         ...
+#
+#     Rmblogging.SPAN_REPORT_INTERVAL = 60.0   # optional: log a summary every minute
+#     Rmblogging.SPAN_REPORT_AT_EXIT = True    # optional: log a summary at exit
+#
+# Each histogram has 4 buckets per power of two (so percentiles are accurate to within about 12%), from 1 ns up to
+# about 70 minutes. See measure_span_overhead() for the cost of a span.
+
+_SPAN_BUCKETS = 164
+
+
+def _span_bucket(ns):
+    """
+    :param ns: (int) A duration, in nanoseconds
+    :return: (int) Index of the histogram bucket it goes into
+    """
+    if ns < 8:
+        return ns if ns > 0 else 0
+    bit_length = ns.bit_length()
+    index = (bit_length << 2) - 8 + ((ns >> (bit_length - 3)) & 3)
+    return index if index < _SPAN_BUCKETS else _SPAN_BUCKETS - 1
+
+
+def _span_bucket_bounds(index):
+    """
+    :param index: (int) Index of a histogram bucket
+    :return: (tuple) The (lower, upper) bounds of the bucket, in nanoseconds
+    """
+    if index < 8:
+        return index, index + 1
+    octave, sub = divmod(index - 8, 4)
+    shift = octave + 1
+    return (4 + sub) << shift, (5 + sub) << shift
+
+
+class _SpanHistogram:
+
+    def __init__(self):
+        self.buckets = [0] * _SPAN_BUCKETS
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def add(self, ns):
+        # (Same as _span_bucket(), inlined since this is the hot path)
+        if ns < 8:
+            index = ns if ns > 0 else 0
+        else:
+            bit_length = ns.bit_length()
+            index = (bit_length << 2) - 8 + ((ns >> (bit_length - 3)) & 3)
+            if index >= _SPAN_BUCKETS:
+                index = _SPAN_BUCKETS - 1
+        self.buckets[index] += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def merge(self, other):
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.total_ns += other.total_ns
+        self.max_ns = max(self.max_ns, other.max_ns)
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def percentile(self, fraction):
+        """
+        :param fraction: (float) E.g., 0.95 for the 95th percentile
+        :return: (int) Estimated duration at that percentile, in nanoseconds (the middle of its bucket)
+        """
+        target = fraction * self.count
+        cumulative = 0
+        for index, count in enumerate(self.buckets):
+            cumulative += count
+            if count and cumulative >= target:
+                lower, upper = _span_bucket_bounds(index)
+                return min((lower + upper) // 2, self.max_ns)
+        return self.max_ns
+
+
+# Each thread records into histograms of its own (no locking on the hot path). _span_tables holds every thread's
+# table of span path -> _SpanHistogram, they are merged when reporting.
+_span_lock = threading.Lock()
+_span_tables = []
+_span_thread = threading.local()  # .stack: the active (path, start_ns) of the current thread, .table: its histograms
+_span_paths = {}  # (parent path, name) -> path, so nested paths aren't rebuilt on every use
+_span_next_report_ns = [0]
+
+
+def _span_thread_state():
+    stack = _span_thread.stack = []
+    table = _span_thread.table = {}
+    with _span_lock:
+        _span_tables.append(table)
+    return stack
+
+
+class Span:
+    """
+    A named timing span. Use as a context manager or as a decorator (see above). A Span object holds no per-use
+    state, so the same one can be used by several threads at once, and recursively.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: (str) Name of the span
+        """
+        self.name = name
+
+    def __enter__(self):
+        try:
+            stack = _span_thread.stack
+        except AttributeError:
+            stack = _span_thread_state()
+        if stack:
+            key = (stack[-1][0], self.name)
+            try:
+                path = _span_paths[key]
+            except KeyError:
+                # (Direct recursion stays on the same path, rather than growing it by one level per call)
+                parent = key[0]
+                path = parent if parent.rpartition('/')[2] == self.name else f"{parent}/{self.name}"
+                _span_paths[key] = path
+        else:
+            path = self.name
+        stack.append((path, time.perf_counter_ns()))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        end_ns = time.perf_counter_ns()
+        path, start_ns = _span_thread.stack.pop()
+        table = _span_thread.table
+        try:
+            table[path].add(end_ns - start_ns)
+        except KeyError:
+            histogram = table[path] = _SpanHistogram()
+            histogram.add(end_ns - start_ns)
+        if Rmblogging.SPAN_REPORT_INTERVAL is not None and end_ns >= _span_next_report_ns[0]:
+            if _span_next_report_ns[0]:
+                report_spans()
+            _span_next_report_ns[0] = end_ns + int(Rmblogging.SPAN_REPORT_INTERVAL * 1_000_000_000)
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def timed(func):
+    """
+    Decorator: time each call of func as a Span named after the function.
+    """
+    return Span(func.__qualname__)(func)
+
+
+def _format_ns(ns):
+    if ns < 1_000:
+        return f"{ns}ns"
+    if ns < 1_000_000:
+        return f"{ns / 1_000:.2f}us"
+    if ns < 1_000_000_000:
+        return f"{ns / 1_000_000:.2f}ms"
+    return f"{ns / 1_000_000_000:.2f}s"
+
+
+def span_stats():
+    """
+    :return: (dict) For each span path: a dict with count, total_ns, p50_ns, p95_ns, p99_ns and max_ns
+    """
+    histograms = {}
+    with _span_lock:
+        tables = list(_span_tables)
+    for table in tables:
+        for path, histogram in list(table.items()):
+            merged = histograms.get(path)
+            if merged is None:
+                merged = histograms[path] = _SpanHistogram()
+            merged.merge(histogram)
+    return {path: {'count': histogram.count,
+                   'total_ns': histogram.total_ns,
+                   'p50_ns': histogram.percentile(0.50),
+                   'p95_ns': histogram.percentile(0.95),
+                   'p99_ns': histogram.percentile(0.99),
+                   'max_ns': histogram.max_ns}
+            for path, histogram in histograms.items()}
+
+
+def report_spans(level=None):
+    """
+    Log a summary of all timing spans recorded so far: one line per span, children indented below their parent.
+
+    :param level: (LogLevels) Level to log at (default: Rmblogging.SPAN_REPORT_LEVEL)
+    """
+    if level is None:
+        level = Rmblogging.SPAN_REPORT_LEVEL
+    stats = span_stats()
+    if not stats or not Rmblogging.is_enabled(level):
+        return
+    with unsuppressed():
+        logmsg(level, f"~~~ timing spans ({len(stats)}) ~~~")
+        for path in sorted(stats):
+            st = stats[path]
+            depth = path.count('/')
+            name = '  ' * depth + path.rpartition('/')[2]
+            logmsg(level, f"{name:40s} n={st['count']:<8d} total={_format_ns(st['total_ns']):>9s} "
+                          f"p50={_format_ns(st['p50_ns']):>9s} p95={_format_ns(st['p95_ns']):>9s} "
+                          f"p99={_format_ns(st['p99_ns']):>9s} max={_format_ns(st['max_ns']):>9s}")
+
+
+def reset_spans():
+    """
+    Discard all timing span statistics recorded so far.
+    """
+    with _span_lock:
+        for table in _span_tables:
+            table.clear()
+
+
+def measure_span_overhead(iterations=100000):
+    """
+    :param iterations: (int) Number of (empty) spans to time
+    :return: (float) The overhead of entering and exiting a span, in nanoseconds per span
+    """
+    name = '__overhead__'
+    overhead_span = Span(name)
+    start_ns = time.perf_counter_ns()
+    for _ in range(iterations):
+        pass
+    empty_loop_ns = time.perf_counter_ns() - start_ns
+    start_ns = time.perf_counter_ns()
+    for _ in range(iterations):
+        with overhead_span:
+            pass
+    span_loop_ns = time.perf_counter_ns() - start_ns
+    _span_thread.table.pop(name, None)
+    return max(span_loop_ns - empty_loop_ns, 0) / iterations
+
+
+def _report_spans_at_exit():
+    if Rmblogging.SPAN_REPORT_AT_EXIT:
+        report_spans()
+
 
-    # I like to add a '()' to the end of the method name
-    return f"{caller.function}()"
+atexit.register(_report_spans_at_exit)
 
 
 # ~~~~~~~~~~~~~~~~~~~~~~~+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -0,0 +1,274 @@
+#!/bin/env python3
+"""
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+rmblogsink.py - Structured, memory-mapped log sink for rmblogging (and a reader for it)
+
+Instead of "[LEVEL TIMESTAMP] MESSAGE" text lines, each log message is appended as a compact binary record
+(level, epoch-ns, caller, message) to a preallocated, memory-mapped segment file. When a segment is full the sink
+rolls over to the next one. Writing a record is a memory copy - there's no per-message syscall.
+
+Example..
+
+    import rmblogsink
+    from rmblogging import LogLevels
+
+    rmblogsink.start_structured_sink('logs')      # From now on, debug(), info(), etc. go to logs/rmblog.*.seg
+    ...
+
+    for level, epoch_ns, caller, msg in rmblogsink.read_records('logs', level=LogLevels.WARNING):
+        print(level.name, epoch_ns, caller, msg)
+
+Or from the command line (prints matching records as JSONL)..
+
+    python rmblogsink.py logs --level WARNING --since 2024-01-31T12:00:00
+
+Segment file layout (all integers little-endian)..
+
+    Header (64 bytes): magic (8s), version (u32), end of data offset (u32), first epoch-ns (i64), last epoch-ns (i64),
+                       zero padding
+    Records:           total record length (u32), level (u8), epoch-ns (i64), caller length (u16), caller (utf-8),
+                       message (utf-8)
+
+The header's first/last timestamps let the reader skip whole segments outside of the requested time range, and the
+fixed-size record headers let it skip records by level and time without decoding them.
+~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+
+import argparse
+import atexit
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from datetime import datetime
+
+from rmblogging import Rmblogging, LogLevels
+
+MAGIC = b'RMBLOG\x00\x01'
+VERSION = 1
+SEGMENT_HEADER = struct.Struct('<8sIIqq')
+SEGMENT_HEADER_SIZE = 64
+RECORD_HEADER = struct.Struct('<IBqH')
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def _segment_filename(directory, basename, number):
+    return os.path.join(directory, f"{basename}.{number:06d}.seg")
+
+
+def _segment_numbers(directory, basename):
+    """
+    :return: (list) The numbers of the existing segment files, in ascending order
+    """
+    pattern = re.compile(re.escape(basename) + r'\.(\d{6})\.seg$')
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(m.group(1)) for m in (pattern.match(name) for name in names) if m)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class MmapSegmentSink:
+    """
+    Appends log records to memory-mapped segment files named <basename>.<NNNNNN>.seg in a directory. Use as
+    Rmblogging.sink (see start_structured_sink()).
+    """
+
+    def __init__(self, directory, basename='rmblog', segment_size=DEFAULT_SEGMENT_SIZE, max_segments=None):
+        """
+        :param directory: (str) Where the segment files go. Created if needed.
+        :param basename: (str) Segment file name prefix
+        :param segment_size: (int) Size of each (preallocated) segment file, in bytes
+        :param max_segments: (int) If set, the oldest segment files are deleted to keep at most this many
+        """
+        if segment_size <= SEGMENT_HEADER_SIZE + RECORD_HEADER.size or segment_size >= 2**32:
+            raise ValueError(f"Unsupported segment size: {segment_size}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.basename = basename
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._offset = 0
+        self._first_ns = self._last_ns = 0
+        existing = _segment_numbers(directory, basename)
+        self._number = existing[-1] if existing else 0  # Never append to a segment written by an earlier run
+        self._open_next_segment()
+
+    def _open_next_segment(self):
+        self._close_segment()
+        self._number += 1
+        filename = _segment_filename(self.directory, self.basename, self._number)
+        with open(filename, 'w+b') as f:
+            f.truncate(self.segment_size)
+            self._mmap = mmap.mmap(f.fileno(), self.segment_size)
+        self._offset = SEGMENT_HEADER_SIZE
+        self._first_ns = self._last_ns = 0
+        self._write_segment_header()
+
+        if self.max_segments is not None:
+            for number in _segment_numbers(self.directory, self.basename)[:-self.max_segments]:
+                try:
+                    os.remove(_segment_filename(self.directory, self.basename, number))
+                except FileNotFoundError:
+                    pass
+
+    def _write_segment_header(self):
+        SEGMENT_HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, self._offset, self._first_ns, self._last_ns)
+
+    def _close_segment(self):
+        if self._mmap is not None:
+            self._write_segment_header()
+            self._mmap.flush()
+            self._mmap.close()
+            self._mmap = None
+
+    def write_record(self, level, epoch_ns, caller, msg):
+        """
+        :param level: (LogLevels) Logging level
+        :param epoch_ns: (int) Time of the message, in nanoseconds since the epoch
+        :param caller: (str) Name of the calling function (may be empty)
+        :param msg: (str) The message
+        """
+        caller_bytes = (caller or '').encode('utf-8', 'replace')[:0xFFFF]
+        msg_bytes = msg.encode('utf-8', 'replace')
+        max_payload = self.segment_size - SEGMENT_HEADER_SIZE - RECORD_HEADER.size
+        if len(caller_bytes) + len(msg_bytes) > max_payload:
+            msg_bytes = msg_bytes[:max(0, max_payload - len(caller_bytes))]
+        length = RECORD_HEADER.size + len(caller_bytes) + len(msg_bytes)
+
+        with self._lock:
+            if self._mmap is None:
+                return  # Closed
+            if self._offset + length > self.segment_size:
+                self._open_next_segment()
+            offset = self._offset
+            RECORD_HEADER.pack_into(self._mmap, offset, length, level, epoch_ns, len(caller_bytes))
+            offset += RECORD_HEADER.size
+            self._mmap[offset:offset + len(caller_bytes)] = caller_bytes
+            offset += len(caller_bytes)
+            self._mmap[offset:offset + len(msg_bytes)] = msg_bytes
+            self._offset = offset + len(msg_bytes)
+            self._first_ns = min(self._first_ns, epoch_ns) if self._first_ns else epoch_ns
+            self._last_ns = max(self._last_ns, epoch_ns)
+            self._write_segment_header()
+
+    def flush(self):
+        """
+        Ask the OS to write the current segment to disk. (Not needed for other processes to see the records, only to
+        survive a system crash.)
+        """
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.flush()
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def start_structured_sink(directory, basename='rmblog', segment_size=DEFAULT_SEGMENT_SIZE, max_segments=None):
+    """
+    Send all rmblogging output to a new MmapSegmentSink (replacing any previous one, which is closed). Parameters are
+    as for MmapSegmentSink.
+
+    :return: (MmapSegmentSink) The new sink
+    """
+    stop_structured_sink()
+    sink = MmapSegmentSink(directory, basename=basename, segment_size=segment_size, max_segments=max_segments)
+    Rmblogging.sink = sink
+    return sink
+
+
+def stop_structured_sink():
+    """
+    Close the structured sink (if any), and go back to text output via Rmblogging.print_func.
+    """
+    sink = Rmblogging.sink
+    if sink is None:
+        return
+    Rmblogging.sink = None
+    sink.close()
+
+
+atexit.register(stop_structured_sink)
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def read_records(directory, basename='rmblog', level=None, since_ns=None, until_ns=None):
+    """
+    Stream the records of all segment files, oldest segment first. Segments are read while they're being written,
+    too (records written so far are returned).
+
+    :param directory: (str) Directory holding the segment files
+    :param basename: (str) Segment file name prefix
+    :param level: (LogLevels) If set, only records of this level or more severe are returned
+    :param since_ns: (int) If set, only records at or after this time (nanoseconds since the epoch) are returned
+    :param until_ns: (int) If set, only records before this time (nanoseconds since the epoch) are returned
+    :return: (generator) Yields (level, epoch_ns, caller, msg) tuples, level being a LogLevels
+    """
+    max_level = 0xFF if level is None else level
+    since_ns = -2**63 if since_ns is None else since_ns
+    until_ns = 2**63 - 1 if until_ns is None else until_ns
+
+    for number in _segment_numbers(directory, basename):
+        filename = _segment_filename(directory, basename, number)
+        try:
+            with open(filename, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < SEGMENT_HEADER_SIZE:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    magic, version, end, first_ns, last_ns = SEGMENT_HEADER.unpack_from(mm, 0)
+                    if magic != MAGIC or version != VERSION:
+                        continue
+                    if first_ns and (last_ns < since_ns or first_ns >= until_ns):
+                        continue  # Nothing in this segment is in the time range
+                    yield from _read_segment(mm, min(end, len(mm)), max_level, since_ns, until_ns)
+        except FileNotFoundError:
+            continue  # Removed by the writer (max_segments) while we were reading
+
+
+def _read_segment(mm, end, max_level, since_ns, until_ns):
+    offset = SEGMENT_HEADER_SIZE
+    while offset + RECORD_HEADER.size <= end:
+        length, level, epoch_ns, caller_len = RECORD_HEADER.unpack_from(mm, offset)
+        if length < RECORD_HEADER.size or offset + length > end:
+            break  # Partially written (or corrupt) record
+        if level <= max_level and since_ns <= epoch_ns < until_ns:
+            start = offset + RECORD_HEADER.size
+            caller = mm[start:start + caller_len].decode('utf-8', 'replace')
+            msg = mm[start + caller_len:offset + length].decode('utf-8', 'replace')
+            yield LogLevels(level), epoch_ns, caller, msg
+        offset += length
+
+
+def _parse_time(value):
+    """
+    :param value: (str) ISO 8601 date/time (local time, unless it has an offset) or nanoseconds since the epoch
+    :return: (int) Nanoseconds since the epoch
+    """
+    if value.isdigit():
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp() * 1_000_000_000)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Print the records of rmblogsink segment files as JSONL')
+    parser.add_argument("directory")
+    parser.add_argument("--basename", default='rmblog')
+    parser.add_argument("--level", default=None, type=str.upper, choices=[level.name for level in LogLevels])
+    parser.add_argument("--since", default=None, type=_parse_time)
+    parser.add_argument("--until", default=None, type=_parse_time)
+    cmdline_args = parser.parse_args()
+
+    max_level = None if cmdline_args.level is None else LogLevels[cmdline_args.level]
+    for level, epoch_ns, caller, msg in read_records(cmdline_args.directory, cmdline_args.basename, max_level,
+                                                     cmdline_args.since, cmdline_args.until):
+        print(json.dumps({'level': level.name, 'epoch_ns': epoch_ns, 'caller': caller, 'msg': msg}))
@@ -1,18 +1,232 @@
 #!/bin/env python3
+"""
+RMB's random numbers module
 
-from random import randint, random, seed
-from datetime import datetime
+Random values are drawn from generators (random.Random instances) owned by this module: one per thread, in each
+process. They're seeded once, from OS entropy, or from an explicit seed via seed_streams(). The global state of the
+random module is left alone.
+
+The batch functions (randval_0_to_1_batch(), randval_int_batch()) return NumPy arrays, filled by a single vectorized
+call, if NumPy is installed. Otherwise they fall back to array.array, filled one value at a time. RandomPool hands
+out values one at a time from such batches.
+"""
+
+import hashlib
+import multiprocessing
+import os
+import queue
+import random
+import threading
+import weakref
+from array import array
+from functools import partial
 from rmblogging import Rmblogging, LogLevels, debug, info, notice, warning, error
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Per-thread/per-process streams. With an explicit seed, each thread's stream is seeded from that seed plus the names of
+# its process and thread (e.g., 'MainProcess'/'MainThread', 'ForkPoolWorker-2'/'MainThread') and the process's fork
+# path (which fork of which fork it is), so a run is repeatable as long as those are. Without one, each stream gets
+# fresh OS entropy.
+#
+# For parallel runs that must be replayable, streams can instead be keyed explicitly, per worker or (better, since it
+# doesn't depend on how tasks get scheduled) per task. Child seeds are hashes of the root seed and the key, so child
+# streams are independent of each other and of the root..
+#
+#     root = rmbrandom.root_seed()     # Logged at NOTICE; rmbrandom.seed_streams(root) replays the run
+#
+#     def task(task_id):
+#         rmbrandom.bind_stream('task', task_id)    # or: rng = rmbrandom.task_stream('task', task_id)
+#         ...
+#
+#     with ProcessPoolExecutor(initializer=rmbrandom.init_worker_streams,
+#                              initargs=rmbrandom.worker_stream_initargs()) as pool:
+#         pool.map(task, range(1000))
+
+_root_seed = None  # The explicit seed passed to seed_streams(), None for OS entropy
+_generation = 0  # Bumped whenever the streams must be re-created (new seed, or after a fork)
+_thread_state = threading.local()  # .stream: (generation, random.Random), .numpy_stream: (generation, numpy Generator)
+                                   # .key: the key the thread's streams are bound to (see bind_stream())
+_forks = 0  # Number of times this process has forked
+_fork_path = ()  # For a forked process: the parent's fork path, plus which of its forks this process is
+
+
+def _derive_seed(*keys):
+    """
+    :param keys: Anything with a stable repr() (ints, strings, tuples of them)
+    :return: (int) A 256-bit seed derived from the keys
+    """
+    return int.from_bytes(hashlib.sha256(repr(keys).encode()).digest(), 'big')
+
+
+def seed_streams(seed=None):
+    """
+    (Re)seed the streams of all threads. Each thread's stream is re-created on its next draw.
+
+    :param seed: (int or str) Root seed, or None to seed from OS entropy
+    """
+    global _root_seed, _generation
+    _root_seed = seed
+    _generation += 1
+
+
+def new_root_seed():
+    """
+    Seed the streams of all threads from a new, random (128-bit) root seed, which is logged at NOTICE so that the run
+    can be replayed with seed_streams(seed).
+
+    :return: (int) The new root seed
+    """
+    seed = int.from_bytes(os.urandom(16), 'big')
+    seed_streams(seed)
+    notice("rmbrandom root seed: %d (pass it to rmbrandom.seed_streams() to replay this run)", seed)
+    return seed
+
+
+def root_seed():
+    """
+    :return: (int or str) The root seed, after creating one with new_root_seed() if there isn't one yet
+    """
+    if _root_seed is None:
+        return new_root_seed()
+    return _root_seed
+
+
+def spawn_seed(*key):
+    """
+    :param key: Identifies the child stream, e.g. ('task', 17). Anything with a stable repr() (ints, strings, ...)
+    :return: (int) Seed of the child stream, derived from the root seed (see root_seed()) and the key
+    """
+    return _derive_seed(root_seed(), 'spawn', key)
+
+
+def task_stream(*key):
+    """
+    :param key: Identifies the child stream, e.g. ('task', 17)
+    :return: (random.Random) A new generator for the child stream (always the same sequence for the same root seed and key)
+    """
+    return random.Random(spawn_seed(*key))
+
+
+def bind_stream(*key):
+    """
+    Bind the current thread's streams (stream(), numpy_stream(), and so everything else in this module) to the child
+    stream identified by key, restarting them. Without a key, go back to the default (name-based) streams.
+
+    :param key: Identifies the child stream, e.g. ('task', 17)
+    """
+    if key:
+        root_seed()
+        _thread_state.key = key
+    else:
+        _thread_state.__dict__.pop('key', None)
+    _thread_state.__dict__.pop('stream', None)
+    _thread_state.__dict__.pop('numpy_stream', None)
+
+
+def _stream_seed(kind):
+    """
+    :param kind: (str) Which of the thread's streams the seed is for ('random' or 'numpy')
+    :return: (int) Seed for the current thread's stream of that kind, or None if it's to be seeded from OS entropy
+    """
+    key = getattr(_thread_state, 'key', None)
+    if key is not None:
+        keys = (root_seed(), 'spawn', key)
+    elif _root_seed is None:
+        return None
+    else:
+        keys = (_root_seed, _fork_path, multiprocessing.current_process().name, threading.current_thread().name)
+    if kind != 'random':
+        keys += (kind,)
+    return _derive_seed(*keys)
+
+
+def worker_stream_initargs(context=None):
+    """
+    :param context: (multiprocessing context) The context the pool uses (default: multiprocessing's default context)
+    :return: (tuple) initargs for init_worker_streams(): the root seed (see root_seed()) and a shared worker counter
+    """
+    if context is None:
+        context = multiprocessing.get_context()
+    return (root_seed(), context.Value('i', 0))
+
+
+def init_worker_streams(seed, worker_counter):
+    """
+    Pool initializer: seed this worker process's streams from the root seed, and bind its main thread to the child
+    stream ('worker', N), N being a unique (0-based) worker number. Use with worker_stream_initargs().
+
+    NOTE: Which worker gets which number depends on process start-up order. For runs that replay exactly, bind (or
+    create) streams per task instead, see bind_stream() and task_stream().
+
+    :param seed: The root seed
+    :param worker_counter: (multiprocessing.Value) Shared counter handing out the worker numbers
+    """
+    with worker_counter.get_lock():
+        worker_number = worker_counter.value
+        worker_counter.value += 1
+    seed_streams(seed)
+    bind_stream('worker', worker_number)
+
+
+def stream():
+    """
+    :return: (random.Random) The current thread's generator
+    """
+    try:
+        generation, rng = _thread_state.stream
+        if generation == _generation:
+            return rng
+    except AttributeError:
+        pass
+    seed = _stream_seed('random')
+    rng = random.Random(os.urandom(32) if seed is None else seed)
+    _thread_state.stream = (_generation, rng)
+    return rng
+
+
+def numpy_stream():
+    """
+    :return: (numpy.random.Generator) The current thread's NumPy generator (requires NumPy)
+    """
+    try:
+        generation, rng = _thread_state.numpy_stream
+        if generation == _generation:
+            return rng
+    except AttributeError:
+        pass
+    rng = numpy.random.default_rng(_stream_seed('numpy'))
+    _thread_state.numpy_stream = (_generation, rng)
+    return rng
+
+
+def _before_fork():
+    global _forks
+    _forks += 1
+
+
+def _after_fork_in_child():
+    global _generation, _forks, _fork_path
+    _fork_path += (_forks,)
+    _forks = 0
+    _generation += 1  # The child must not continue the parent's streams
+
+
+os.register_at_fork(before=_before_fork, after_in_child=_after_fork_in_child)
+
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 def randval_0_to_1():
     """
     Generate a random float value x, such that 0.0 <= x < 1.0
     """
-    seed(datetime.now().strftime('%f%S%M%H'))
-    randomvalue = random()
-    debug(f"returning random float: {randomvalue}")
+    randomvalue = stream().random()
+    debug("returning random float: %s", randomvalue)
     return randomvalue
 
 
@@ -23,12 +237,209 @@ def randval_int(bounds):
     """
     A = bounds[0]
     B = bounds[1]
-    debug(f"Generating a random integer in the range {A}-{B}")
-    debug(f"Seeding random number generator..")
-    seed(datetime.now().strftime('%f%S%M%H'))
-    debug(f"Generating the random integer..")
-    randomvalue = randint(A, B-1)
-    debug(f"Random integer is {randomvalue}")
-    debug(f"Returning {randomvalue}")
+    debug("Generating a random integer in the range %s-%s", A, B)
+    randomvalue = stream().randrange(A, B)
+    debug("Random integer is %s", randomvalue)
+    debug("Returning %s", randomvalue)
     return randomvalue
 
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+def _check_out(out, n, typecode):
+    """
+    :return: (int) The batch size: n, or len(out) if n is None
+    """
+    if out is None:
+        if n is None or n < 0:
+            raise ValueError(f"Invalid batch size: {n}")
+        return n
+    if n is not None and n != len(out):
+        raise ValueError(f"Batch size {n} doesn't match the size of the out buffer ({len(out)})")
+    if isinstance(out, array) and out.typecode != typecode:
+        raise ValueError(f"out buffer must be an array.array of typecode '{typecode}', not '{out.typecode}'")
+    return len(out)
+
+
+def randval_0_to_1_batch(n=None, out=None):
+    """
+    Generate n random float values x, such that 0.0 <= x < 1.0
+
+    :param n: (int) Number of values (may be omitted if out is given)
+    :param out: (numpy.ndarray of float64, or array.array('d')) Optional buffer to fill, instead of allocating one
+    :return: (numpy.ndarray, or array.array('d') without NumPy) The values (out itself, if given)
+    """
+    n = _check_out(out, n, 'd')
+    debug("Generating %s random floats", n)
+    if numpy is not None and (out is None or isinstance(out, numpy.ndarray)):
+        return numpy_stream().random(n, out=out)
+    rnd = stream().random
+    values = array('d', [rnd() for _ in range(n)])
+    if out is None:
+        return values
+    out[:] = values
+    return out
+
+
+def randval_int_batch(bounds, n=None, out=None):
+    """
+    Generate n random integers i, such that A <= i < B, where A is the first element of bounds, B is the second
+
+    :param bounds: (tuple) (A, B)
+    :param n: (int) Number of values (may be omitted if out is given)
+    :param out: (numpy.ndarray of an integer dtype, or array.array('q')) Optional buffer to fill, instead of allocating
+                one. (A NumPy out buffer saves the allocation of the result, not of NumPy's intermediate array.)
+    :return: (numpy.ndarray of int64, or array.array('q') without NumPy) The values (out itself, if given)
+    """
+    A = bounds[0]
+    B = bounds[1]
+    if A >= B:
+        raise ValueError(f"Empty range for randval_int_batch: {A}-{B}")
+    n = _check_out(out, n, 'q')
+    debug("Generating %s random integers in the range %s-%s", n, A, B)
+    if numpy is not None and (out is None or isinstance(out, numpy.ndarray)):
+        values = numpy_stream().integers(A, B, size=n, dtype=numpy.int64)
+        if out is None:
+            return values
+        out[...] = values
+        return out
+    randrange = stream().randrange
+    values = array('q', [randrange(A, B) for _ in range(n)])
+    if out is None:
+        return values
+    out[:] = values
+    return out
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+class RandomPool:
+    """
+    Iterator handing out single random values from chunks generated in bulk (vectorized, with NumPy), for the hottest
+    loops, where even the per-call overhead of randval_0_to_1() shows..
+
+        jitter = RandomPool()                      # floats x, 0.0 <= x < 1.0
+        dice = RandomPool((1, 7), background=True)  # ints i, 1 <= i < 7
+
+        for ...:
+            delay = next(jitter)
+            roll = next(dice)
+
+    With background=True, the next chunk is generated by a background thread while the current one is handed out, so
+    refills stay off the critical path.
+
+    Each pool has a generator of its own, seeded from the creating thread's stream (so pools are reproducible with
+    seed_streams(), too). A pool must not be shared between threads.
+
+    close() the pool (or use it as a context manager) when done with it: that stops the background thread, and the
+    pool then raises StopIteration once the values already generated run out. (The background thread is also stopped
+    when the pool is garbage collected.)
+    """
+
+    def __init__(self, bounds=None, chunk_size=65536, background=False):
+        """
+        :param bounds: (tuple) (A, B) for integers i, A <= i < B, or None for floats x, 0.0 <= x < 1.0
+        :param chunk_size: (int) Number of values generated per refill
+        :param background: (bool) Whether to generate the next chunk in a background thread
+        """
+        if bounds is not None and bounds[0] >= bounds[1]:
+            raise ValueError(f"Empty range for RandomPool: {bounds[0]}-{bounds[1]}")
+        if chunk_size < 1:
+            raise ValueError(f"Invalid chunk size: {chunk_size}")
+        self.bounds = bounds
+        self.chunk_size = chunk_size
+
+        seed = stream().getrandbits(128)
+        # (NumPy generates int64s only: wider ranges go through random.Random, like randval_int() does)
+        in_int64_range = bounds is None or (-2**63 <= bounds[0] and bounds[1] <= 2**63)
+        rng = numpy.random.default_rng(seed) if numpy is not None and in_int64_range else random.Random(seed)
+        self._generate = partial(_generate_chunk, rng, bounds, chunk_size)
+
+        self._values = []
+        self._index = 0
+        self._closed = False
+        self._chunks = None
+        if background:
+            # (The thread mustn't reference the pool itself, so that an abandoned pool can still be collected - and
+            # its finalizer then stops the thread)
+            self._chunks = queue.Queue(maxsize=1)
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=_run_pool_thread,
+                                            args=(self._generate, self._chunks, self._stop_event),
+                                            name='rmbrandom-pool', daemon=True)
+            self._thread.start()
+            self._finalizer = weakref.finalize(self, _stop_pool_thread, self._chunks, self._stop_event)
+
+    def _refill(self):
+        if self._closed:
+            raise StopIteration
+        if self._chunks is None:
+            self._values = self._generate()
+        else:
+            values = self._chunks.get()
+            if isinstance(values, BaseException):
+                self._chunks.put(values)  # (Raised again by any later next(), too)
+                raise values
+            self._values = values
+        self._index = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        index = self._index
+        if index >= len(self._values):
+            self._refill()
+            index = 0
+        self._index = index + 1
+        return self._values[index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        Stop the background thread (if any). Once the values already generated run out, the pool raises StopIteration.
+        """
+        self._closed = True
+        if self._chunks is not None:
+            self._finalizer()
+
+
+def _generate_chunk(rng, bounds, n):
+    """
+    :param rng: (numpy.random.Generator or random.Random) The pool's generator
+    :param bounds: (tuple) As for RandomPool
+    :param n: (int) Number of values
+    :return: (list) A new chunk of values
+    """
+    if not isinstance(rng, random.Random):
+        if bounds is None:
+            return rng.random(n).tolist()
+        return rng.integers(bounds[0], bounds[1], size=n, dtype=numpy.int64).tolist()
+    if bounds is None:
+        rnd = rng.random
+        return [rnd() for _ in range(n)]
+    randrange = rng.randrange
+    A, B = bounds
+    return [randrange(A, B) for _ in range(n)]
+
+
+def _run_pool_thread(generate, chunks, stop_event):
+    while not stop_event.is_set():
+        try:
+            chunk = generate()
+        except Exception as e:
+            chunks.put(e)  # Raised by the consumer's next(), rather than leaving it waiting forever
+            return
+        chunks.put(chunk)
+
+
+def _stop_pool_thread(chunks, stop_event):
+    stop_event.set()
+    try:
+        chunks.get_nowait()  # Make room, in case the thread is blocked putting a chunk (it then sees stop_event)
+    except queue.Empty:
+        pass
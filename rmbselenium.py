@@ -12,15 +12,17 @@ import sys
 from datetime import datetime
 from time import sleep
 
-import selenium.common.exceptions
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as ec
-from selenium.webdriver.support.wait import WebDriverWait
-
 import rmblogging
-from rmblogging import Rmblogging, LogLevels, debug, info, warning, error
+from rmblogging import Rmblogging, LogLevels, debug, info, warning, error, timed
+from rmbimports import lazy_import
+
+# Selenium is imported when first used (by RmbSelenium()), not when this module is imported
+selenium = lazy_import('selenium')
+webdriver = lazy_import('selenium.webdriver')
+Options = lazy_import('selenium.webdriver.chrome.options', 'Options')
+By = lazy_import('selenium.webdriver.common.by', 'By')
+ec = lazy_import('selenium.webdriver.support.expected_conditions')
+WebDriverWait = lazy_import('selenium.webdriver.support.wait', 'WebDriverWait')
 
 
 class RmbSelenium:
@@ -103,6 +105,7 @@ class RmbSelenium:
             "profile.default_content_setting_values.notifications": 2
         })
 
+    @timed
     def sleep(self, seconds, msg=None):
 
         if seconds <= 4:
@@ -123,6 +126,7 @@ class RmbSelenium:
 
         sleep(sleepval)
 
+    @timed
     def start_browser(self):
         if 'alias' in self.site.keys():
             alias = self.site['alias']
@@ -214,6 +218,7 @@ class RmbSelenium:
         else:
             print(f'Whoa! Found an alien in examine_driver!')
 
+    @timed
     def login(self):
         """
         Attempts to log in to the intended site whoose URL is in self.url.
@@ -279,6 +284,7 @@ class RmbSelenium:
             element = self.long_wait.until(ec.element_to_be_clickable((By.XPATH, self.xpaths['continue_to_email'])))
             element.click()
 
+    @timed
     def logout(self):
         """
         Attempts to log out of the currently active site
@@ -302,6 +308,7 @@ class RmbSelenium:
         element = self.long_wait.until(ec.element_to_be_clickable((By.XPATH, self.xpaths['logout_button'])))
         element.click()
 
+    @timed
     def wait_for_element_helper(self, ec_method, xpath_expression):
         """
         - OPTIONAL -